@@ -35,23 +35,31 @@ void scanner_utf8_engine(void) {
 #define UTF_8_LEN_4_MASK  0xf8    /* 0b11111000 */
 #define UTF_8_LEN_4_BITS  0xf0    /* 0b11110000 */
 
+int utf8_length(char c) {
+    if ((c & UTF_8_LEN_2_MASK) == UTF_8_LEN_2_BITS) {
+        return 2;
+    } else if ((c & UTF_8_LEN_3_MASK) == UTF_8_LEN_3_BITS) {
+        return 3;
+    } else if ((c & UTF_8_LEN_4_MASK) == UTF_8_LEN_4_BITS) {
+        return 4;
+    }
+    return 1;
+}
+
+int scanner_scans_characters(struct scanner *s) {
+    return (s->engines == NULL ||
+            s->engines->production == &scanner_utf8_engine ||
+            s->engines->production == &scanner_byte_engine);
+}
+
 const struct term *scan(struct scanner *s) {
     if (s->position >= s->size) {
         return &tamsin_EOF;
     }
     if (s->engines == NULL || s->engines->production == &scanner_utf8_engine) {
-        char c = s->buffer[s->position];
-        int len = 1;
+        int len = utf8_length(s->buffer[s->position]);
         const struct term *t;
 
-        if ((c & UTF_8_LEN_2_MASK) == UTF_8_LEN_2_BITS) {
-            len = 2;
-        } else if ((c & UTF_8_LEN_3_MASK) == UTF_8_LEN_3_BITS) {
-            len = 3;
-        } else if ((c & UTF_8_LEN_4_MASK) == UTF_8_LEN_4_BITS) {
-            len = 4;
-        }
-
         t = term_new_atom(s->buffer + s->position, len);
         s->position += len;
         return t;
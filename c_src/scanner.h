@@ -32,6 +32,18 @@ void scanner_pop_engine(struct scanner *);
 void scanner_byte_engine(void);
 void scanner_utf8_engine(void);
 
+/*
+ * Returns 1 if the current engine of the scanner scans each character
+ * (or byte) of the buffer as a token by itself, otherwise 0.
+ */
+int scanner_scans_characters(struct scanner *);
+
+/*
+ * Returns the number of bytes in the UTF-8 sequence which starts with
+ * the given byte (1 if it does not start a multi-byte sequence.)
+ */
+int utf8_length(char);
+
 /*
  * This value is never (and should never be) exposed to Tamsin programs!
  * It should not be considered a kind of term, really.  That's just for
@@ -4,6 +4,7 @@
  */
 
 #include <assert.h>
+#include <string.h>
 
 #include "tamsin.h"
 
@@ -124,6 +125,93 @@ void tamsin_startswith(struct scanner *s, const char *str) {
     }
 }
 
+/*
+ * Consumes the longest run of tokens which `accept` accepts, and makes
+ * the result all of those tokens concatenated together.  Always succeeds.
+ * When every character is a token, a run of ASCII characters is checked
+ * right in the buffer, without making a term for each one.
+ */
+static void tamsin_span(struct scanner *s,
+                        int (*accept)(const char *, size_t, const struct term *),
+                        const struct term *arg) {
+    const struct term *t;
+
+    if (scanner_scans_characters(s)) {
+        int start = s->position;
+
+        for (;;) {
+            if (s->position < s->size && !(s->buffer[s->position] & 0x80)) {
+                if (!accept(s->buffer + s->position, 1, arg)) {
+                    break;
+                }
+                s->position++;
+                continue;
+            }
+            commit(s);
+            t = scan(s);
+            if (t == &tamsin_EOF || !accept(t->atom, t->size, arg)) {
+                unscan(s);
+                break;
+            }
+        }
+        commit(s);
+        result = term_new_atom(s->buffer + start, s->position - start);
+    } else {
+        /* scanning with a production clobbers result, so build it aside */
+        const struct term *span = term_new_atom("", 0);
+
+        for (;;) {
+            t = scan(s);
+            if (t == &tamsin_EOF || !accept(t->atom, t->size, arg)) {
+                unscan(s);
+                break;
+            }
+            commit(s);
+            span = term_concat(span, t);
+        }
+        result = span;
+    }
+    ok = 1;
+}
+
+static int accept_alnum(const char *text, size_t size,
+                        const struct term *arg) {
+    return size > 0 && tamsin_isalnum(text[0]);
+}
+
+static int accept_until(const char *text, size_t size,
+                        const struct term *stop) {
+    return !(size == stop->size && memcmp(text, stop->atom, size) == 0);
+}
+
+static int accept_in(const char *text, size_t size,
+                     const struct term *set) {
+    size_t i = 0;
+
+    while (i < set->size) {
+        size_t len = utf8_length(set->atom[i]);
+
+        if (len == size && i + len <= set->size &&
+            memcmp(text, set->atom + i, size) == 0) {
+            return 1;
+        }
+        i += len;
+    }
+    return 0;
+}
+
+void tamsin_span_alnum(struct scanner *s) {
+    tamsin_span(s, accept_alnum, NULL);
+}
+
+void tamsin_span_until(struct scanner *s, const struct term *stop) {
+    tamsin_span(s, accept_until, stop);
+}
+
+void tamsin_span_in(struct scanner *s, const struct term *set) {
+    tamsin_span(s, accept_in, set);
+}
+
 const struct term *tamsin_unquote(const struct term *q,
                                   const struct term *l, const struct term *r) {
     int i;
@@ -292,6 +380,87 @@ const struct term *tamsin_length(const struct term *t) {
     return term_new_atom_from_cstring(buffer);
 }
 
+/** lists **/
+
+/*
+ * Returns 1 if the given term is a list(H, T) cell, otherwise 0.
+ */
+static int is_list_cell(const struct term *t) {
+    return (t->subterms != NULL && t->subterms->next != NULL &&
+            t->subterms->next->next == NULL &&
+            term_atom_cstring_equal(t, "list"));
+}
+
+const struct term *tamsin_list_append(const struct term *list,
+                                      const struct term *rest) {
+    const struct term **elements;
+    const struct term *l;
+    const struct term *res;
+    int count = 0;
+    int i;
+
+    for (l = list; is_list_cell(l); l = l->subterms->next->term) {
+        count++;
+    }
+    if (!term_atom_cstring_equal(l, "nil") || l->subterms != NULL) {
+        res = term_new_atom_from_cstring("malformed list ");
+        res = term_concat(res, term_flatten(list));
+        ok = 0;
+        return res;
+    }
+
+    elements = malloc(sizeof(const struct term *) * (count + 1));
+    i = 0;
+    for (l = list; is_list_cell(l); l = l->subterms->next->term) {
+        elements[i++] = l->subterms->term;
+    }
+
+    res = rest;
+    for (i = count - 1; i >= 0; i--) {
+        struct termlist *tl = NULL;
+
+        termlist_add_term(&tl, res);
+        termlist_add_term(&tl, elements[i]);
+        res = term_new_constructor("list", 4, tl);
+    }
+    free(elements);
+
+    ok = 1;
+    return res;
+}
+
+const struct term *tamsin_list_member(const struct term *x,
+                                      const struct term *list) {
+    const struct term *l;
+    const struct term *res;
+
+    for (l = list; is_list_cell(l); l = l->subterms->next->term) {
+        if (term_equal(x, l->subterms->term)) {
+            ok = 1;
+            return l->subterms->term;
+        }
+    }
+
+    res = term_new_atom_from_cstring("term '");
+    res = term_concat(res, term_flatten(x));
+    res = term_concat(res, term_new_atom_from_cstring("' is not a member"));
+    ok = 0;
+    return res;
+}
+
+const struct term *tamsin_list_length(const struct term *list) {
+    const struct term *l;
+    unsigned long count = 0;
+
+    for (l = list; is_list_cell(l); l = l->subterms->next->term) {
+        count++;
+    }
+
+    sprintf(buffer, "%lu", count);
+
+    return term_new_atom_from_cstring(buffer);
+}
+
 /** repr **/
 
 /*
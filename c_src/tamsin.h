@@ -17,6 +17,9 @@ void tamsin_expect(struct scanner *, const struct term *);
 void tamsin_alnum(struct scanner *);
 void tamsin_upper(struct scanner *);
 void tamsin_startswith(struct scanner *, const char *);
+void tamsin_span_alnum(struct scanner *);
+void tamsin_span_until(struct scanner *, const struct term *);
+void tamsin_span_in(struct scanner *, const struct term *);
 const struct term *tamsin_unquote(const struct term *,
                                   const struct term *, const struct term *);
 const struct term *tamsin_mkterm(const struct term *, const struct term *);
@@ -26,6 +29,11 @@ const struct term *tamsin_gensym(const struct term *);
 const struct term *tamsin_hexbyte(const struct term *, const struct term *);
 const struct term *tamsin_format_octal(const struct term *);
 const struct term *tamsin_length(const struct term *);
+const struct term *tamsin_list_append(const struct term *,
+                                      const struct term *);
+const struct term *tamsin_list_member(const struct term *,
+                                      const struct term *);
+const struct term *tamsin_list_length(const struct term *);
 
 /*
  * Given a possibly non-atom term, return an atom consisting of
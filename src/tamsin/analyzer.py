@@ -11,6 +11,15 @@ from tamsin.ast import (
 )
 from tamsin.term import Term
 from tamsin.event import EventProducer
+from tamsin.scanner import EOF
+
+
+# builtins which neither consume input nor have any other effect which
+# would be visible after backtracking
+PURE_BUILTINS = (
+    'return', 'equal', 'unquote', 'mkterm', 'reverse', 'repr',
+    'hexbyte', 'format_octal', 'length',
+)
 
 
 class Analyzer(EventProducer):
@@ -21,9 +30,18 @@ class Analyzer(EventProducer):
       sticking that in the locals_ field of the new Production node.
     * Resolving any '' modules in Prodrefs to the name of the current
       module.
+    * Assigning each variable used in each production branch a slot in
+      the frame of that branch, so that the interpreter can find its value
+      by index instead of by name.  The names of the slots are stuck in
+      the slot_names field of the new ProdBranch node.
 
-    * Looking for undefined nonterminals and raising an error if such found.
+    * Looking for undefined nonterminals and raising an error if such found,
+      and pointing each Call and Using node at the Production it refers to.
       (this is done at the end by analyze_prodrefs)
+    * Finding the FIRST set of each rule, and whether it is nullable, so
+      that the interpreter can skip the alternatives of an Or which cannot
+      possibly succeed on the upcoming token.
+      (this is done at the very end by analyze_first_sets)
 
     TODO: it should also find any locals that are accessed before being set
     TODO: it should also look for a mismatch in # of formals
@@ -32,6 +50,7 @@ class Analyzer(EventProducer):
         self.listeners = listeners
         self.program = program
         self.current_module = None
+        self.current_slots = None
 
     def analyze(self, ast):
         if isinstance(ast, Program):
@@ -41,6 +60,7 @@ class Analyzer(EventProducer):
                 modlist.append(mod)
             self.program = Program(modlist)
             self.analyze_prodrefs(self.program)
+            self.analyze_first_sets(self.program)
             return self.program
         elif isinstance(ast, Module):
             self.current_module = ast
@@ -54,11 +74,17 @@ class Analyzer(EventProducer):
             for b in ast.branches:
                 branches.append(self.analyze(b))
             return Production(ast.name, branches)
-        elif isinstance(ast, ProdBranch):            
+        elif isinstance(ast, ProdBranch):
             locals_ = []
+            self.collect_locals(ast.body, locals_)
+            slot_names = self.collect_slot_names(ast)
+            self.current_slots = dict(
+                [(name, i) for (i, name) in enumerate(slot_names)]
+            )
+            formals = [self.analyze(f) for f in ast.formals]
             body = self.analyze(ast.body)
-            self.collect_locals(body, locals_)
-            return ProdBranch(ast.formals, locals_, body)
+            self.current_slots = None
+            return ProdBranch(formals, locals_, body, slot_names=slot_names)
         elif isinstance(ast, Or):
             return Or(self.analyze(ast.lhs), self.analyze(ast.rhs))
         elif isinstance(ast, And):
@@ -68,19 +94,35 @@ class Analyzer(EventProducer):
         elif isinstance(ast, On):
             return On(self.analyze(ast.rule), self.analyze(ast.texpr))
         elif isinstance(ast, Call):
-            return Call(self.analyze(ast.prodref), ast.args)
+            return Call(
+                self.analyze(ast.prodref), [self.analyze(a) for a in ast.args]
+            )
         elif isinstance(ast, Send):
             assert isinstance(ast.pattern, TermNode), ast
             return Send(self.analyze(ast.rule), self.analyze(ast.pattern))
         elif isinstance(ast, Set):
             assert isinstance(ast.variable, VariableNode), ast
-            return Set(ast.variable, self.analyze(ast.texpr))
+            return Set(self.analyze(ast.variable), self.analyze(ast.texpr))
         elif isinstance(ast, Not):
             return Not(self.analyze(ast.rule))
         elif isinstance(ast, While):
             return While(self.analyze(ast.rule))
         elif isinstance(ast, Concat):
             return Concat(self.analyze(ast.lhs), self.analyze(ast.rhs))
+        elif isinstance(ast, VariableNode):
+            if self.current_slots is None:
+                return ast
+            return VariableNode(ast.name, self.current_slots[ast.name])
+        elif isinstance(ast, PatternVariableNode):
+            if self.current_slots is None:
+                return ast
+            return PatternVariableNode(
+                ast.name, ast.index, self.current_slots[ast.name]
+            )
+        elif isinstance(ast, ConstructorNode):
+            return ConstructorNode(
+                ast.text, [self.analyze(x) for x in ast.contents]
+            )
         elif isinstance(ast, TermNode):
             return ast
         elif isinstance(ast, Prodref):
@@ -131,8 +173,57 @@ class Analyzer(EventProducer):
         else:
             raise NotImplementedError(repr(ast))
 
+    def collect_slot_names(self, branch):
+        """Returns a list of the names of all variables used in the given
+        ProdBranch: those in its formals first, then its locals, then any
+        which are only ever read (in the arguments of calls, for example.)
+
+        """
+        variables = []
+        for f in branch.formals:
+            f.collect_variables(variables)
+        names = []
+        for v in variables:
+            if v.name not in names:
+                names.append(v.name)
+        self.collect_locals(branch.body, names)
+        self.collect_all_variables(branch.body, names)
+        return names
+
+    def collect_all_variables(self, ast, names):
+        """Like collect_locals, but also looks in the arguments of calls.
+        names should be a list."""
+
+        if isinstance(ast, Call):
+            for a in ast.args:
+                self.collect_all_variables(a, names)
+        elif (isinstance(ast, And) or isinstance(ast, Or) or
+              isinstance(ast, Concat)):
+            self.collect_all_variables(ast.lhs, names)
+            self.collect_all_variables(ast.rhs, names)
+        elif (isinstance(ast, Using) or isinstance(ast, Not) or
+              isinstance(ast, While)):
+            self.collect_all_variables(ast.rule, names)
+        elif isinstance(ast, On):
+            self.collect_all_variables(ast.rule, names)
+            self.collect_all_variables(ast.texpr, names)
+        elif isinstance(ast, Send):
+            self.collect_all_variables(ast.rule, names)
+        elif isinstance(ast, Set):
+            self.collect_all_variables(ast.texpr, names)
+        elif isinstance(ast, TermNode):
+            variables = []
+            ast.collect_variables(variables)
+            for v in variables:
+                if v.name not in names:
+                    names.append(v.name)
+        else:
+            raise NotImplementedError(repr(ast))
+
     def analyze_prodrefs(self, ast):
-        """does not return anything"""
+        """does not return anything, except when given a Prodref, in
+        which case it returns the Production it refers to (or None, for
+        a builtin.)"""
         if isinstance(ast, Program):
             for mod in ast.modlist:
                 self.analyze_prodrefs(mod)
@@ -149,11 +240,11 @@ class Analyzer(EventProducer):
             self.analyze_prodrefs(ast.rhs)
         elif isinstance(ast, Using):
             self.analyze_prodrefs(ast.rule)
-            self.analyze_prodrefs(ast.prodref)
+            ast.production = self.analyze_prodrefs(ast.prodref)
         elif isinstance(ast, On):
             self.analyze_prodrefs(ast.rule)
         elif isinstance(ast, Call):
-            self.analyze_prodrefs(ast.prodref)
+            ast.production = self.analyze_prodrefs(ast.prodref)
         elif isinstance(ast, Send):
             self.analyze_prodrefs(ast.rule)
         elif isinstance(ast, Set):
@@ -169,14 +260,108 @@ class Analyzer(EventProducer):
         elif isinstance(ast, Prodref):
             assert ast.module != '', repr(ast)
             if ast.module == '$':
-                return # TODO: also check builtins?
-            module = self.program.find_module(ast.module)
-            if not module:
-                raise KeyError("no '%s' module defined" % ast.module)
-            production = module.find_production(ast.name)
-            if not production:
-                raise KeyError("no '%s:%s' production defined" %
-                    (ast.module, ast.name)
-                )
+                return None # TODO: also check builtins?
+            return self.program.find_production(ast)
         else:
             raise NotImplementedError(repr(ast))
+
+    def analyze_first_sets(self, program):
+        """Sets the first and nullable fields of every Production, and
+        every rule in it, of the given (analyzed) Program.
+
+        If the first field of a rule is not None, it promises that, if
+        the next token (as scanned by whatever scanner is active when the
+        rule begins) is not in it, the rule will either fail, or (only if
+        nullable is True) succeed without consuming any input; and that
+        either way, it will not have done anything which backtracking
+        would not undo.  So when the left-hand side of an Or is not
+        nullable, and the next token is not in its first set, it can be
+        skipped.
+
+        The sets of productions depend on each other, so they are found
+        by starting from the empty set and iterating until nothing changes.
+
+        """
+        prods = []
+        for module in program.modlist:
+            prods.extend(module.prodlist)
+        for prod in prods:
+            prod.first = frozenset()
+            prod.nullable = False
+        changed = True
+        while changed:
+            changed = False
+            for prod in prods:
+                first = frozenset()
+                nullable = False
+                for b in prod.branches:
+                    (b_first, b_nullable) = self.first_set(b.body)
+                    first = union_first(first, b_first)
+                    nullable = nullable or b_nullable
+                if first != prod.first or nullable != prod.nullable:
+                    prod.first = first
+                    prod.nullable = nullable
+                    changed = True
+
+    def first_set(self, ast):
+        """Returns the (first, nullable) pair for the given rule, and
+        also sets them on it.  Uses the first and nullable fields of
+        the Productions it calls, as they are known so far."""
+        if isinstance(ast, And):
+            (lhs_first, lhs_nullable) = self.first_set(ast.lhs)
+            (rhs_first, rhs_nullable) = self.first_set(ast.rhs)
+            if lhs_nullable:
+                first = union_first(lhs_first, rhs_first)
+                nullable = rhs_nullable
+            else:
+                first = lhs_first
+                nullable = False
+        elif isinstance(ast, Or):
+            (lhs_first, lhs_nullable) = self.first_set(ast.lhs)
+            (rhs_first, rhs_nullable) = self.first_set(ast.rhs)
+            first = union_first(lhs_first, rhs_first)
+            nullable = lhs_nullable or rhs_nullable
+        elif isinstance(ast, While):
+            (first, nullable) = self.first_set(ast.rule)
+            nullable = True
+        elif isinstance(ast, Send):
+            (first, nullable) = self.first_set(ast.rule)
+        elif isinstance(ast, Not):
+            self.first_set(ast.rule)
+            (first, nullable) = (None, True)
+        elif isinstance(ast, Using) or isinstance(ast, On):
+            self.first_set(ast.rule)
+            (first, nullable) = (None, True)
+        elif isinstance(ast, Call):
+            prodref = ast.prodref
+            if prodref.module != '$':
+                first = ast.production.first
+                nullable = ast.production.nullable
+            elif (prodref.name == 'expect' and
+                  isinstance(ast.args[0], AtomNode)):
+                (first, nullable) = (frozenset([ast.args[0].text]), False)
+            elif prodref.name == 'eof':
+                (first, nullable) = (frozenset([EOF]), False)
+            elif prodref.name == 'fail':
+                (first, nullable) = (frozenset(), False)
+            elif prodref.name in PURE_BUILTINS:
+                (first, nullable) = (frozenset(), True)
+            else:
+                (first, nullable) = (None, True)
+        elif isinstance(ast, Set) or isinstance(ast, Concat):
+            (first, nullable) = (frozenset(), True)
+        elif isinstance(ast, TermNode):
+            (first, nullable) = (frozenset(), True)
+        else:
+            raise NotImplementedError(repr(ast))
+        ast.first = first
+        ast.nullable = nullable
+        return (first, nullable)
+
+
+def union_first(a, b):
+    """Returns the union of two first sets, either of which may be None
+    (meaning 'not known'.)"""
+    if a is None or b is None:
+        return None
+    return a | b
@@ -8,7 +8,7 @@
 # __repr__ : make a string that is valid Python code for constructing the AST
 
 
-from tamsin.term import Atom, Variable, Constructor
+from tamsin.term import Term, Atom, Variable, constructor, intern_atom
 
 
 def format_list(l):
@@ -19,6 +19,13 @@ def format_list(l):
 
 
 class AST(object):
+    # The set of tokens which a rule may start with (or None if it is not
+    # known), and whether it may succeed without consuming any; filled in
+    # by the Analyzer.  See Analyzer.analyze_first_sets for what exactly
+    # these promise.
+    first = None
+    nullable = True
+
     def __unicode__(self):
         raise NotImplementedError(repr(self))
 
@@ -26,6 +33,8 @@ class AST(object):
 class Program(AST):
     def __init__(self, modlist):
         self.modlist = modlist
+        # (module name, production name) -> Production; built on demand
+        self.index = None
 
     def find_module(self, name):
         for m in self.modlist:
@@ -33,10 +42,28 @@ class Program(AST):
                 return m
         return None
 
+    def build_index(self):
+        self.index = {}
+        for module in self.modlist:
+            if self.find_module(module.name) is not module:
+                continue
+            for prod in module.prodlist:
+                key = (module.name, prod.name)
+                if key in self.index:
+                    # leave it to Module.find_production to complain
+                    self.index[key] = None
+                else:
+                    self.index[key] = prod
+
     def find_production(self, prodref):
         module_name = prodref.module
         prod_name = prodref.name
         assert module_name != ''
+        if self.index is None:
+            self.build_index()
+        production = self.index.get((module_name, prod_name))
+        if production is not None:
+            return production
         module = self.find_module(module_name)
         if not module:
             raise KeyError("no '%s' module defined" % module_name)
@@ -58,6 +85,7 @@ class Program(AST):
             if self.find_module(modname):
                 raise KeyError("module '%s' already defined" % modname)
             self.modlist.append(module)
+        self.index = None
 
     def __repr__(self):
         return "Program(%r)" % self.modlist
@@ -92,6 +120,37 @@ class Production(AST):
     def __init__(self, name, branches):
         self.name = name
         self.branches = branches
+        # index_key of first argument -> branches which might match it;
+        # built on demand
+        self.index = None
+        # the branches which might match any first argument
+        self.wildcards = None
+
+    def build_index(self):
+        keys = {}
+        for b in self.branches:
+            key = b.first_key()
+            if key is not None:
+                keys[key] = True
+        self.index = {}
+        for key in keys:
+            self.index[key] = [
+                b for b in self.branches if b.first_key() in (None, key)
+            ]
+        self.wildcards = [b for b in self.branches if b.first_key() is None]
+
+    def candidates(self, args):
+        """Returns the branches of this production which might match the
+        given arguments, in the order in which they should be tried.  Only
+        looks at the first argument, so the formals of each still need to
+        be matched against the arguments.
+
+        """
+        if not args or len(self.branches) == 1:
+            return self.branches
+        if self.index is None:
+            self.build_index()
+        return self.index.get(args[0].index_key(), self.wildcards)
 
     def link(self, other):
         if self.next is None:
@@ -113,10 +172,52 @@ class Production(AST):
 
 
 class ProdBranch(AST):
-    def __init__(self, formals, locals_, body):
+    def __init__(self, formals, locals_, body, slot_names=None):
+        """`slot_names` is the list of the names of all the variables used
+        in this branch, in the order of the slots they are assigned in
+        its frame.  It is assigned by the Analyzer.
+
+        """
         self.formals = formals
         self.locals_ = locals_
         self.body = body
+        self.slot_names = slot_names
+        # the formals as Terms, a function which matches them, and the
+        # list the values bound to their variables are put into; built on
+        # demand
+        self.patterns = None
+        self.matcher = None
+        self.unifier = None
+
+    def get_patterns(self):
+        if self.patterns is None:
+            self.patterns = [f.to_term() for f in self.formals]
+            self.matcher = Term.compile_match_all(self.patterns)
+            # the variables in the formals have the first slots
+            slots = set()
+            for p in self.patterns:
+                slots.update(p.slots())
+            self.unifier = [None] * len(slots)
+        return self.patterns
+
+    def first_key(self):
+        """Returns the index_key of the first formal of this branch,
+        or None if it has no formals."""
+        patterns = self.get_patterns()
+        if not patterns:
+            return None
+        return patterns[0].index_key()
+
+    def match(self, args):
+        """Returns True if the given arguments match the formals of this
+        branch, leaving the values bound to the variables in the formals
+        in `self.unifier` (which holds the first slots of the branch's
+        frame), or False if they do not.
+
+        """
+        if self.matcher is None:
+            self.get_patterns()
+        return self.matcher(args, self.unifier)
 
     def __repr__(self):
         return u"Prodbranch(%r, %r, %r)" % (
@@ -223,6 +324,8 @@ class Call(AST):
         for a in args:
             assert isinstance(a, AST)
         self.args = args
+        # the Production called; filled in by the Analyzer
+        self.production = None
 
     def __repr__(self):
         return u"Call(%r, %r)" % (
@@ -241,6 +344,26 @@ class Send(AST):
     def __init__(self, rule, pattern):
         self.rule = rule
         self.pattern = pattern
+        # the slots of the variables in the pattern, a function which
+        # matches it, and the list the values bound to those variables
+        # are put into; built on demand
+        self.slots = None
+        self.matcher = None
+        self.unifier = None
+
+    def match(self, value):
+        """Returns True if the given value matches the pattern, leaving
+        the values bound to the variables in the pattern in
+        `self.unifier`, at the slots listed in `self.slots`, or False if
+        it does not.
+
+        """
+        if self.matcher is None:
+            term = self.pattern.to_term()
+            self.slots = term.slots()
+            self.matcher = term.matcher()
+            self.unifier = [None] * (max(self.slots + [-1]) + 1)
+        return self.matcher(value, self.unifier)
 
     def __repr__(self):
         return u"Send(%r, %r)" % (self.rule, self.pattern)
@@ -278,6 +401,8 @@ class Using(AST):
         self.rule = rule
         assert isinstance(prodref, Prodref)
         self.prodref = prodref
+        # the Production used as a scanner; filled in by the Analyzer
+        self.production = None
 
     def __repr__(self):
         return u"Using(%r, %r)" % (self.rule, self.prodref)
@@ -344,12 +469,13 @@ class AtomNode(TermNode):
         pass
 
     def to_term(self):
-        return Atom(self.text)
+        return intern_atom(self.text)
 
 
 class VariableNode(TermNode):
-    def __init__(self, name):
+    def __init__(self, name, slot=None):
         self.name = name
+        self.slot = slot
 
     def __repr__(self):
         return u"VariableNode(%r)" % self.name
@@ -361,13 +487,14 @@ class VariableNode(TermNode):
         variables.append(self)
 
     def to_term(self):
-        return Variable(self.name)
+        return Variable(self.name, self.slot)
 
 
 class PatternVariableNode(TermNode):
-    def __init__(self, name, index):
+    def __init__(self, name, index, slot=None):
         self.name = name
         self.index = index
+        self.slot = slot
 
     def __repr__(self):
         return u"PatternVariableNode(%r, %r)" % (self.name, self.index)
@@ -379,7 +506,7 @@ class PatternVariableNode(TermNode):
         variables.append(self)
 
     def to_term(self):
-        return Variable(self.name)
+        return Variable(self.name, self.slot)
 
 
 class ConstructorNode(TermNode):
@@ -403,6 +530,6 @@ class ConstructorNode(TermNode):
             x.collect_variables(variables)
 
     def to_term(self):
-        return Constructor(self.text, [
+        return constructor(self.text, [
             x.to_term() for x in self.contents
         ])
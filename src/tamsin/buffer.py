@@ -3,15 +3,45 @@
 # Copyright (c)2014 Chris Pressey, Cat's Eye Technologies.
 # Distributed under a BSD-style license; see LICENSE for more information.
 
+from bisect import bisect_right
+import mmap
+import os
+import stat
 import sys
 
 
+class LineIndex(object):
+    """The positions at which lines start, over part of a buffer.
+    `starts[0]` is the start of line number `first_line`.
+
+    When a buffer forgets the earlier part of its line index, it does not
+    change its LineIndex, but replaces it with a new one, which becomes
+    the `successor` of the old one; the old one covers the positions
+    before `end`.  So something which kept the old LineIndex can still
+    work out the line number of a position which the buffer has since
+    forgotten.
+
+    """
+    __slots__ = ('starts', 'first_line', 'end', 'successor')
+
+    def __init__(self, starts, first_line):
+        self.starts = starts
+        self.first_line = first_line
+        self.end = None
+        self.successor = None
+
+
 class Buffer(object):
     """Abstract base class for all Buffer objects.
 
     Buffer objects are mutable, but must be capable of saving and restoring
     their state indefinitely.
 
+    The state of a Buffer is just its position (a byte offset.)  The line
+    and column numbers of a position are only worked out when they are
+    asked for, from an index of where each line starts, which is extended
+    as far as it needs to be each time.
+
     """
     def __init__(self, filename='<data>', position=0, line_number=1, column_number=1):
         """If `position` is given, `line_number` and `column_number` should
@@ -20,8 +50,9 @@ class Buffer(object):
         """
         self.filename = filename
         self.position = position
-        self.line_number = line_number
-        self.column_number = column_number
+        self.lines = LineIndex([position - (column_number - 1)], line_number)
+        # the position up to which newlines have been put in the index
+        self.indexed = position
 
     def save_state(self):
         raise NotImplementedError
@@ -32,20 +63,105 @@ class Buffer(object):
     def pop_state(self):
         raise NotImplementedError
 
-    def advance(self, inp):
-        """Given a string that we have just consumed from the buffer,
-        return new line_number and column_number.
+    def commit(self):
+        """Tells the buffer that it will not be returned to any position
+        before the current one, so it need not keep anything it was
+        keeping only for that.  Must only be called when no state is saved.
 
         """
-        line_number = self.line_number
-        column_number = self.column_number
-        for char in inp:
-            if char == '\n':
-                line_number += 1
-                column_number = 1
-            else:
-                column_number += 1
-        return (line_number, column_number)
+        self.forget_lines(self.position)
+
+    def tell(self):
+        """Returns an object representing the current position of the
+        buffer, which may later be passed to seek().
+
+        """
+        return self.position
+
+    def seek(self, state):
+        """Moves the buffer to a position previously returned by tell().
+        The position must be one the buffer has already been at, and must
+        not be one that it has since discarded.
+
+        """
+        self.position = state
+
+    def earliest_position(self):
+        """Returns the earliest position which the buffer can still be
+        returned to (by restore_state() or seek()).
+
+        """
+        return 0
+
+    def find_newline(self, start, end):
+        """Returns the position of the first newline at or after `start`
+        and before `end`, or -1 if there is none.  Only needs to work for
+        positions which have not been discarded.
+
+        """
+        raise NotImplementedError
+
+    def end_position(self):
+        """Returns the position just past the last byte which has been
+        read into the buffer."""
+        raise NotImplementedError
+
+    def index_lines(self, position):
+        """Makes sure the line index covers everything up to `position`."""
+        position = min(position, self.end_position())
+        start = self.indexed
+        starts = self.lines.starts
+        while start < position:
+            newline = self.find_newline(start, position)
+            if newline == -1:
+                break
+            start = newline + 1
+            starts.append(start)
+        if position > self.indexed:
+            self.indexed = position
+
+    def forget_lines(self, position):
+        """Discards the part of the line index before the line that
+        `position` is on.  Positions before that may only be asked about
+        afterwards by way of the LineIndex which was current when they
+        were reached (see line_and_column.)
+
+        This must be called before any data before `position` is thrown
+        away, since it first extends the index up to `position`.
+
+        """
+        self.index_lines(position)
+        lines = self.lines
+        i = bisect_right(lines.starts, position) - 1
+        if i > 0:
+            self.lines = LineIndex(lines.starts[i:], lines.first_line + i)
+            lines.end = self.indexed
+            lines.successor = self.lines
+
+    def line_and_column(self, position, lines=None):
+        """Returns the line number and column number of the given
+        position.  If `lines` is given, it is the LineIndex which was
+        current when the buffer was at (or past the start of the line
+        of) that position.
+
+        """
+        if lines is None:
+            lines = self.lines
+        while lines.successor is not None and position >= lines.end:
+            lines = lines.successor
+        if lines.successor is None:
+            position = min(position, self.end_position())
+            self.index_lines(position)
+        i = bisect_right(lines.starts, position) - 1
+        return (lines.first_line + i, position - lines.starts[i] + 1)
+
+    @property
+    def line_number(self):
+        return self.line_and_column(self.position)[0]
+
+    @property
+    def column_number(self):
+        return self.line_and_column(self.position)[1]
 
     def chop(self, amount):
         """Returns a pair of `amount` characters chopped off the front of
@@ -61,6 +177,14 @@ class Buffer(object):
         """
         raise NotImplementedError
 
+    def span(self, pattern):
+        """Returns the length of the longest prefix of the rest of the
+        buffer which the compiled regular expression `pattern` matches
+        (0 if it does not match), without consuming it.
+
+        """
+        raise NotImplementedError
+
 
 class StringBuffer(Buffer):
     def __init__(self, string, **kwargs):
@@ -76,14 +200,25 @@ class StringBuffer(Buffer):
         Buffer.__init__(self, **kwargs)
 
     def save_state(self):
-        self.stack.append((self.position, self.line_number, self.column_number))
+        self.stack.append(self.position)
 
     def restore_state(self):
-        (self.position, self.line_number, self.column_number) = self.stack.pop()
+        self.position = self.stack.pop()
 
     def pop_state(self):
         self.stack.pop()
 
+    def earliest_position(self):
+        if self.stack:
+            return self.stack[0]
+        return self.position
+
+    def find_newline(self, start, end):
+        return self.string.find('\n', start, end)
+
+    def end_position(self):
+        return len(self.string)
+
     def __str__(self):
         return self.string
 
@@ -98,7 +233,6 @@ class StringBuffer(Buffer):
         bytes = self.string[self.position:self.position + amount]
 
         self.position += amount
-        (self.line_number, self.column_number) = self.advance(bytes)
 
         return bytes
 
@@ -107,51 +241,207 @@ class StringBuffer(Buffer):
 
         return bytes
 
+    def span(self, pattern):
+        match = pattern.match(self.string, self.position)
+        if match is None:
+            return 0
+        return match.end() - self.position
+
 
 class FileBuffer(Buffer):
-    def __init__(self, file, **kwargs):
+    """A Buffer which reads a file as it is scanned.
+
+    The file is read in blocks, into a bytearray which holds everything
+    from the earliest position the buffer may still be returned to,
+    onward.  When the buffer has no saved states, the part of the
+    bytearray before the current position is no longer needed, and once
+    it makes up at least half of the bytearray, it is discarded.
+
+    """
+    BLOCK_SIZE = 65536
+
+    def __init__(self, file, close_at_eof=False, **kwargs):
+        """If `close_at_eof` is true, the file is closed once all of it
+        has been read.
+
+        """
         self.file = file
+        self.close_at_eof = close_at_eof
+        # for reading from a real file, we go under Python's file object,
+        # so that we get whatever is available (up to BLOCK_SIZE bytes)
+        # instead of waiting until BLOCK_SIZE bytes are available
+        try:
+            self.fd = file.fileno()
+        except (AttributeError, IOError):
+            self.fd = None
+        self.at_eof = False
         # stuff we have read out of the file, but need to keep
-        self.pre_buffer = ''
-        # the position in the file where we started reading into pre_buffer
-        self.pre_position = 0
+        self.data = bytearray()
         self.stack = []
         Buffer.__init__(self, **kwargs)
+        # the position in the file of the first byte in self.data
+        self.data_position = self.position
 
     def save_state(self):
-        state = (self.position, self.line_number, self.column_number)
-        self.stack.append(state)
+        self.stack.append(self.position)
+
+    def earliest_position(self):
+        return self.data_position
+
+    def find_newline(self, start, end):
+        offset = self.data_position
+        found = self.data.find('\n', start - offset, end - offset)
+        if found == -1:
+            return -1
+        return found + offset
+
+    def end_position(self):
+        return self.data_position + len(self.data)
+
+    def _truncate_data(self):
+        if self.stack:
+            return
+        dead = min(self.position - self.data_position, len(self.data))
+        if dead > 0 and dead * 2 >= len(self.data):
+            self.forget_lines(self.data_position + dead)
+            del self.data[:dead]
+            self.data_position += dead
+
+    def _fill(self, amount):
+        """Reads from the file until at least `amount` bytes, starting
+        at the current position, are in self.data, or the file ends.
 
-    def _truncate_pre_buffer(self):
-        if not self.stack and self.position > self.pre_position:
-            self.pre_buffer = self.pre_buffer[self.position - self.pre_position:]
-            self.pre_position = self.position
+        """
+        needed = self.position - self.data_position + amount
+        while len(self.data) < needed and not self.at_eof:
+            if self.fd is not None:
+                block = os.read(self.fd, self.BLOCK_SIZE)
+            else:
+                block = self.file.read(self.BLOCK_SIZE)
+            if block:
+                self.data.extend(block)
+            else:
+                self.at_eof = True
+                if self.close_at_eof:
+                    self.file.close()
 
     def restore_state(self):
-        state = self.stack.pop()
-        (self.position, self.line_number, self.column_number) = state
-        self._truncate_pre_buffer()
+        self.position = self.stack.pop()
+        self._truncate_data()
 
     def pop_state(self):
         self.stack.pop()
-        self._truncate_pre_buffer()
+        self._truncate_data()
 
     def chop(self, amount):
-        pos = self.position - self.pre_position
-        bytes = self.pre_buffer[pos:pos + amount]
-        bytes_to_read = amount - len(bytes)
-        if bytes_to_read > 0:
-            self.pre_buffer += self.file.read(bytes_to_read)
-            bytes = self.pre_buffer[pos:pos + amount]
-            #assert len(pre_bytes) == amount   # no, b/c what about EOF?
+        self._fill(amount)
+        pos = self.position - self.data_position
+        bytes = str(self.data[pos:pos + amount])
 
         self.position += amount
-        (self.line_number, self.column_number) = self.advance(bytes)
-        self._truncate_pre_buffer()
+        self._truncate_data()
         return bytes
 
     def first(self, amount):
-        self.save_state()
-        bytes = self.chop(amount)
-        self.restore_state()
+        self._fill(amount)
+        pos = self.position - self.data_position
+        return str(self.data[pos:pos + amount])
+
+    def span(self, pattern):
+        # match against what we have read so far; only if the match runs
+        # up to the end of that (so it might go on further) do we read
+        # more (as much as one read gives us) and try again, so that we
+        # do not wait for input that is not needed yet
+        self._fill(1)
+        while True:
+            pos = self.position - self.data_position
+            match = pattern.match(self.data, pos)
+            if match is None or match.end() <= pos:
+                return 0
+            if match.end() < len(self.data) or self.at_eof:
+                return match.end() - pos
+            self._fill(len(self.data) - pos + 1)
+
+
+class MmapBuffer(Buffer):
+    """A Buffer which maps a regular file into memory, and scans that.
+    Moving around in it is just changing an offset; the only things
+    copied out of the mapping are the strings returned by chop() and
+    first().
+
+    """
+    def __init__(self, file, **kwargs):
+        self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.length = len(self.map)
+        self.stack = []
+        Buffer.__init__(self, **kwargs)
+
+    def save_state(self):
+        self.stack.append(self.position)
+
+    def restore_state(self):
+        self.position = self.stack.pop()
+
+    def pop_state(self):
+        self.stack.pop()
+
+    def earliest_position(self):
+        if self.stack:
+            return self.stack[0]
+        return self.position
+
+    def find_newline(self, start, end):
+        return self.map.find('\n', start, end)
+
+    def end_position(self):
+        return self.length
+
+    def __repr__(self):
+        return "MmapBuffer(<%d bytes>, filename=%r, position=%r, line_number=%r, column_number=%r)" % (
+            self.length, self.filename, self.position, self.line_number, self.column_number
+        )
+
+    def chop(self, amount):
+        bytes = self.map[self.position:self.position + amount]
+
+        self.position += amount
+
         return bytes
+
+    def first(self, amount):
+        return self.map[self.position:self.position + amount]
+
+    def span(self, pattern):
+        match = pattern.match(self.map, self.position)
+        if match is None or match.end() <= self.position:
+            return 0
+        return match.end() - self.position
+
+
+def buffer_for_file(file, filename='<data>', close=False):
+    """Returns a Buffer which scans the given (open) file: an MmapBuffer
+    if it is a non-empty regular file which we are at the start of, or a
+    FileBuffer otherwise (for pipes, terminals, and so forth.)
+
+    If `close` is true, the file is closed as soon as the Buffer no
+    longer needs it: straight away for an MmapBuffer, which has its own
+    mapping of the file, or once all of it has been read for a
+    FileBuffer.
+
+    """
+    try:
+        fd = file.fileno()
+        st = os.fstat(fd)
+        offset = os.lseek(fd, 0, os.SEEK_CUR)
+    except (AttributeError, EnvironmentError):
+        return FileBuffer(file, filename=filename, close_at_eof=close)
+    if stat.S_ISREG(st.st_mode) and st.st_size > 0 and offset == 0:
+        try:
+            buffer = MmapBuffer(file, filename=filename)
+        except (EnvironmentError, ValueError):
+            pass
+        else:
+            if close:
+                file.close()
+            return buffer
+    return FileBuffer(file, filename=filename, close_at_eof=close)
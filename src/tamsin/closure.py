@@ -0,0 +1,295 @@
+# encoding: UTF-8
+
+# Copyright (c)2014 Chris Pressey, Cat's Eye Technologies.
+# Distributed under a BSD-style license; see LICENSE for more information.
+
+# An execution engine which has the same behaviour as tamsin.interpreter,
+# but which first translates the AST of each production into a tree of
+# Python closures, and then runs those closures, instead of dispatching
+# on the type of each AST node every time it is visited.
+
+
+from tamsin.ast import (
+    Production, And, Or, Not, While, Call, Send, Set, Using, On,
+    Concat, TermNode
+)
+from tamsin.buffer import StringBuffer
+from tamsin.term import Atom, NIL, concat
+from tamsin.interpreter import Interpreter
+from tamsin.scanner import (
+    ByteScannerEngine, UTF8ScannerEngine, ProductionScannerEngine
+)
+import tamsin.sysmod
+
+
+class ClosureInterpreter(Interpreter):
+    """Productions are compiled the first time they are called.  Unlike
+    the tree-walking Interpreter, this does not announce an event for each
+    AST node that it executes.
+
+    """
+    def __init__(self, program, scanner, listeners=None, memo_size=None):
+        Interpreter.__init__(self, program, scanner,
+                             listeners=listeners, memo_size=memo_size)
+        self.compiled = {}
+
+    def __repr__(self):
+        return "ClosureInterpreter(%r, %r, %r)" % (
+            self.program, self.scanner, self.context
+        )
+
+    def interpret(self, ast, args=None):
+        if isinstance(ast, Production):
+            return self.compile_production(ast)(args)
+        return self.compile(ast)()
+
+    def compile_production(self, prod):
+        """Returns a function which, given a list of arguments, executes
+        the given production on them and returns a (bool, result) pair.
+
+        """
+        if prod in self.compiled:
+            return self.compiled[prod]
+
+        name = prod.name
+        bodies = {}
+        context = self.context
+
+        def production(args):
+            branch = None
+            for b in prod.candidates(args):
+                if b.match(args):
+                    branch = b
+                    break
+            if branch is None:
+                raise ValueError("No '%s' production matched arguments %r" %
+                    (name, args)
+                )
+            context.push_scope(name, branch.slot_names, branch.unifier)
+            result = bodies[branch]()
+            context.pop_scope(name)
+            return result
+
+        # registered before the bodies are compiled, so that recursive
+        # calls to this production can find it
+        self.compiled[prod] = production
+        for b in prod.branches:
+            bodies[b] = self.compile(b.body)
+        return production
+
+    def compile(self, ast):
+        """Returns a function which, given no arguments, executes the
+        given rule and returns a (bool, result) pair.
+
+        """
+        if isinstance(ast, And):
+            return self.compile_and(ast)
+        elif isinstance(ast, Or):
+            return self.compile_or(ast)
+        elif isinstance(ast, Call):
+            return self.compile_call(ast)
+        elif isinstance(ast, Send):
+            return self.compile_send(ast)
+        elif isinstance(ast, Using):
+            return self.compile_using(ast)
+        elif isinstance(ast, On):
+            return self.compile_on(ast)
+        elif isinstance(ast, Set):
+            return self.compile_set(ast)
+        elif isinstance(ast, Not):
+            return self.compile_not(ast)
+        elif isinstance(ast, While):
+            return self.compile_while(ast)
+        elif isinstance(ast, Concat) or isinstance(ast, TermNode):
+            term = self.compile_term(ast)
+
+            def term_rule():
+                return (True, term())
+            return term_rule
+        else:
+            raise NotImplementedError(repr(ast))
+
+    def compile_term(self, ast):
+        """Returns a function which, given no arguments, evaluates the
+        given term expression, without expanding its variables.
+
+        """
+        if isinstance(ast, Concat):
+            lhs = self.compile_term(ast.lhs)
+            rhs = self.compile_term(ast.rhs)
+            context = self.context
+
+            def concat_():
+                return concat(lhs().expand(context), rhs().expand(context))
+            return concat_
+        elif isinstance(ast, TermNode):
+            term = ast.to_term()
+            return lambda: term
+        else:
+            raise NotImplementedError(repr(ast))
+
+    def compile_and(self, ast):
+        lhs = self.compile(ast.lhs)
+        rhs = self.compile(ast.rhs)
+
+        def and_():
+            (success, result) = lhs()
+            if not success:
+                return (False, result)
+            return rhs()
+        return and_
+
+    def compile_or(self, ast):
+        lhs = self.compile(ast.lhs)
+        rhs = self.compile(ast.rhs)
+        context = self.context
+        scanner = self.scanner
+
+        lhs_rule = ast.lhs
+        guarded = lhs_rule.first is not None and not lhs_rule.nullable
+
+        def or_():
+            if guarded and self.cannot_start(lhs_rule):
+                return rhs()
+            context.save_state()
+            scanner.save_state()
+            (succeeded, result) = lhs()
+            if succeeded:
+                context.pop_state()
+                scanner.pop_state()
+                return (True, result)
+            context.restore_state()
+            scanner.restore_state("after or")
+            return rhs()
+        return or_
+
+    def compile_call(self, ast):
+        prodref = ast.prodref
+        name = prodref.name
+        terms = [self.compile_term(x) for x in ast.args]
+        context = self.context
+
+        if prodref.module == '$':
+            try:
+                function = tamsin.sysmod.lookup(name)
+            except NotImplementedError:
+                # don't complain unless it's actually called
+                function = lambda self, args: tamsin.sysmod.call(
+                    name, self, args
+                )
+
+            def builtin():
+                args = [t().expand(context) for t in terms]
+                return function(self, args)
+            return builtin
+
+        prod = ast.production or self.program.find_production(prodref)
+        assert prod is not None, "unresolved: " + repr(prodref)
+
+        def call():
+            args = [t().expand(context) for t in terms]
+            if self.memo is not None:
+                return self.interpret_memoized(prod, args)
+            return self.compile_production(prod)(args)
+        return call
+
+    def compile_send(self, ast):
+        rule = self.compile(ast.rule)
+        context = self.context
+
+        def send():
+            (success, result) = rule()
+            if not ast.match(result):
+                return (False, Atom('nomatch'))
+            unifier = ast.unifier
+            for slot in ast.slots:
+                context.store(slot, unifier[slot])
+            return (success, result)
+        return send
+
+    def compile_using(self, ast):
+        rule = self.compile(ast.rule)
+        prodref = ast.prodref
+        scanner = self.scanner
+        if prodref.module == '$' and prodref.name == 'byte':
+            make_engine = ByteScannerEngine
+        elif prodref.module == '$' and prodref.name == 'utf8':
+            make_engine = UTF8ScannerEngine
+        else:
+            prod = ast.production or self.program.find_production(prodref)
+            if not prod:
+                raise ValueError("No such scanner '%s'" % prodref.name)
+            make_engine = lambda: ProductionScannerEngine(self, prod)
+
+        def using():
+            scanner.push_engine(make_engine())
+            (succeeded, result) = rule()
+            scanner.pop_engine()
+            return (succeeded, result)
+        return using
+
+    def compile_on(self, ast):
+        rule = self.compile(ast.rule)
+        texpr = self.compile_term(ast.texpr)
+        context = self.context
+        scanner = self.scanner
+
+        def on():
+            buffer = str(texpr().expand(context))
+            previous_buffer = scanner.get_buffer()
+            scanner.install_buffer(StringBuffer(buffer))
+            (success, result) = rule()
+            scanner.install_buffer(previous_buffer)
+            return (success, result)
+        return on
+
+    def compile_set(self, ast):
+        slot = ast.variable.slot
+        texpr = self.compile_term(ast.texpr)
+        context = self.context
+
+        def set_():
+            result = texpr().expand(context)
+            context.store(slot, result)
+            return (True, result)
+        return set_
+
+    def compile_not(self, ast):
+        rule = self.compile(ast.rule)
+        context = self.context
+        scanner = self.scanner
+
+        def not_():
+            context.save_state()
+            scanner.save_state()
+            (succeeded, result) = rule()
+            context.restore_state()
+            scanner.restore_state("after not")
+            if succeeded:
+                return (False, scanner.failure(
+                    "anything else", scanner.peek()
+                ))
+            return (True, NIL)
+        return not_
+
+    def compile_while(self, ast):
+        rule = self.compile(ast.rule)
+        context = self.context
+        scanner = self.scanner
+
+        def while_():
+            successful_result = NIL
+            succeeded = True
+            while succeeded:
+                context.save_state()
+                scanner.save_state()
+                (succeeded, result) = rule()
+                if succeeded:
+                    context.pop_state()
+                    scanner.pop_state()
+                    successful_result = result
+                else:
+                    context.restore_state()
+                    scanner.restore_state("after while")
+            return (True, successful_result)
+        return while_
@@ -290,6 +290,14 @@ class Compiler(object):
                 elif name == 'startswith':
                     self.emit('tamsin_startswith(scanner, '
                               'term_flatten(%s)->atom);' % argnames[0])
+                elif name == 'span_alnum':
+                    self.emit('tamsin_span_alnum(scanner);')
+                elif name == 'span_until':
+                    self.emit('tamsin_span_until(scanner, '
+                              'term_flatten(%s));' % argnames[0])
+                elif name == 'span_in':
+                    self.emit('tamsin_span_in(scanner, '
+                              'term_flatten(%s));' % argnames[0])
                 elif name == 'unquote':
                     self.emit('result = tamsin_unquote(%s, %s, %s);' %
                         (argnames[2], argnames[1], argnames[0])
@@ -324,6 +332,17 @@ class Compiler(object):
                 elif name == 'length':
                     self.emit('result = tamsin_length(%s);' % argnames[0])
                     self.emit('ok = 1;')
+                elif name == 'list_append':
+                    self.emit('result = tamsin_list_append(%s, %s);' %
+                        (argnames[1], argnames[0])
+                    )
+                elif name == 'list_member':
+                    self.emit('result = tamsin_list_member(%s, %s);' %
+                        (argnames[1], argnames[0])
+                    )
+                elif name == 'list_length':
+                    self.emit('result = tamsin_list_length(%s);' % argnames[0])
+                    self.emit('ok = 1;')
                 else:
                     raise NotImplementedError(name)
             else:
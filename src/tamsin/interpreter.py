@@ -9,91 +9,307 @@ from tamsin.ast import (
     Prodref, Concat, TermNode
 )
 from tamsin.buffer import StringBuffer
-from tamsin.term import Term, Atom
+from tamsin.term import Term, Atom, NIL, TermKey, concat
 from tamsin.event import EventProducer
+from tamsin.memo import MemoTable
 from tamsin.scanner import (
-    ByteScannerEngine, UTF8ScannerEngine, ProductionScannerEngine
+    EOF, ByteScannerEngine, UTF8ScannerEngine, ProductionScannerEngine
 )
 import tamsin.sysmod
 
 
+# the value of a slot in a frame whose variable has not yet been bound
+UNBOUND = object()
+
+
 class Context(EventProducer):
+    """The variables of each active production call, in a stack of frames.
+
+    Each frame is a list, with one slot for each variable used in the
+    production branch being executed; the Analyzer decides which variable
+    goes in which slot, and the names of the slots are kept alongside it.
+
+    Like a Buffer, a Context can save its state, and later restore or
+    discard it.  Saving the state does not copy anything; instead, each
+    time a variable in a frame which already existed when the state was
+    saved is stored, its previous value is recorded in a "trail", which is
+    used to undo the changes when the state is restored.
+
+    """
     def __init__(self, listeners=None):
         self.listeners = listeners
-        self.scopes = []
+        self.frames = []
+        # for each frame, the list of the names of its slots
+        self.names = []
+        # for each frame, the value of self.clock when it was pushed
+        self.stamps = []
+        # list of (frame, slot, previous value)
+        self.trail = []
+        # stack of (length of trail, value of self.clock) for saved states
+        self.marks = []
+        self.clock = 0
+
+        # counters, for seeing how much work the trail does
+        self.saves = 0
+        self.trailed = 0
+        self.bindings = 0
+        self.would_copy = 0
 
     def __repr__(self):
         return "Context(%r)" % (
-            self.scopes
+            [self.scope(i) for i in range(len(self.frames))]
         )
 
-    def push_scope(self, purpose):
-        self.scopes.append({})
-        self.event('push_scope', self)
-
-    def pop_scope(self, purpose):
-        self.scopes.pop()
-        self.event('pop_scope', self)
+    def scope(self, depth=-1):
+        """Returns a dict of the bound variables of the frame at the given
+        depth; for debugging output."""
+        scope = {}
+        for (name, value) in zip(self.names[depth], self.frames[depth]):
+            if value is not UNBOUND:
+                scope[name] = value
+        return scope
 
     def clone(self):
+        """Returns a copy of this Context's frames, which will not change
+        as this Context does; for debugging output."""
         n = Context(listeners=self.listeners)
-        for scope in self.scopes:
-            n.scopes.append(scope.copy())
+        n.frames = [list(frame) for frame in self.frames]
+        n.names = list(self.names)
         return n
 
-    def fetch(self, name):
-        self.event('fetch', name,
-            self.scopes[-1].get(name, 'undefined'), self.scopes[-1]
-        )
-        return self.scopes[-1][name]
+    def push_scope(self, purpose, names, values=None):
+        """`values`, if given, is a list of the values of the first slots
+        of the new frame.
+
+        """
+        if values and self.listeners:
+            # store them one by one, so that they hear about each of them
+            self.push_scope(purpose, names)
+            for (slot, value) in enumerate(values):
+                self.store(slot, value)
+            return
+        if values:
+            self.frames.append(values + [UNBOUND] * (len(names) - len(values)))
+        else:
+            self.frames.append([UNBOUND] * len(names))
+        self.names.append(names)
+        self.stamps.append(self.clock)
+        self.bindings += len(names)
+        if self.listeners:
+            self.event('push_scope', self)
+
+    def pop_scope(self, purpose):
+        self.bindings -= len(self.frames.pop())
+        self.names.pop()
+        self.stamps.pop()
+        if self.listeners:
+            self.event('pop_scope', self)
+
+    def save_state(self):
+        self.clock += 1
+        self.marks.append((len(self.trail), self.clock))
+        self.saves += 1
+        # this is how many bindings would have been copied, if we copied
+        # every frame instead
+        self.would_copy += self.bindings
+
+    def restore_state(self):
+        (length, clock) = self.marks.pop()
+        trail = self.trail
+        while len(trail) > length:
+            (frame, slot, value) = trail.pop()
+            frame[slot] = value
+
+    def pop_state(self):
+        self.marks.pop()
+        if not self.marks:
+            del self.trail[:]
 
-    def store(self, name, value):
+    def fetch(self, slot):
+        value = self.frames[-1][slot]
+        if self.listeners:
+            self.event('fetch', self.names[-1][slot],
+                'undefined' if value is UNBOUND else value, self.scope()
+            )
+        if value is UNBOUND:
+            raise KeyError(self.names[-1][slot])
+        return value
+
+    def store(self, slot, value):
         assert(isinstance(value, Term)), "not a Term: %r" % value
-        self.event('store', name,
-            self.scopes[-1].get(name, 'undefined'), value
-        )
-        self.scopes[-1][name] = value
+        frame = self.frames[-1]
+        previous = frame[slot]
+        if self.listeners:
+            self.event('store', self.names[-1][slot],
+                'undefined' if previous is UNBOUND else previous, value
+            )
+        # a frame pushed since the last save will be gone by the time
+        # that state is restored, so there is no need to trail it
+        if self.marks and self.stamps[-1] < self.marks[-1][1]:
+            self.trail.append((frame, slot, previous))
+            self.trailed += 1
+        frame[slot] = value
 
 
 class Interpreter(EventProducer):
-    def __init__(self, program, scanner, listeners=None):
+    def __init__(self, program, scanner, listeners=None, memo_size=None):
+        """If `memo_size` is given, the interpreter runs in "packrat" mode:
+        the outcome of each call to a production is remembered (for up to
+        `memo_size` calls) and re-used, instead of being recomputed, when
+        the same production is called with the same arguments at the same
+        position in the same buffer with the same scanner.
+
+        Note that, in packrat mode, any side-effects of a production (such
+        as `print`ing something) will not happen again when its outcome
+        is re-used.
+
+        """
         self.listeners = listeners
         self.program = program
         self.scanner = scanner
         self.context = Context(listeners=self.listeners)
+        self.memo = None
+        if memo_size is not None:
+            self.memo = MemoTable(memo_size)
 
     def __repr__(self):
         return "Interpreter(%r, %r, %r)" % (
             self.program, self.scanner, self.context
         )
 
+    def write_stats(self, f):
+        """Writes some counters which describe how much work was done
+        during interpretation to the given file.
+
+        """
+        c = self.context
+        f.write("context: %d saves, %d bindings trailed, "
+                "%d bindings would have been copied\n" %
+                (c.saves, c.trailed, c.would_copy))
+        if self.memo is not None:
+            f.write("memo: %d hits, %d misses, %d entries\n" %
+                    (self.memo.hits, self.memo.misses, len(self.memo)))
+
     ### interpreter proper ---------------------------------- ###
 
+    def find_main_production(self, program, name):
+        try:
+            return program.find_production(Prodref('main', name))
+        except KeyError:
+            raise ValueError("no 'main:%s' production defined" % name)
+
     def interpret_program(self, program):
-        main = program.find_production(Prodref('main', 'main'))
-        if not main:
-            raise ValueError("no 'main:main' production defined")
+        main = self.find_main_production(program, 'main')
         return self.interpret(main)
 
+    def interpret_records(self, program, name):
+        """Applies the production `main:<name>` to the input over and
+        over, until the end of the input is reached, and yields the
+        (bool, result) pair of each application, as each one finishes.
+        Stops after the first one which fails.
+
+        After each record, commit() is called, so memory used for the
+        input (and for memoized outcomes) does not pile up over the run.
+
+        """
+        prod = self.find_main_production(program, name)
+        scanner = self.scanner
+        while scanner.peek() is not EOF:
+            buffer = scanner.get_buffer()
+            position = buffer.position
+            (succeeded, result) = self.interpret(prod)
+            yield (succeeded, result)
+            if not succeeded:
+                return
+            if buffer.position == position:
+                raise ValueError("'%s' production consumed no input" % name)
+            self.commit()
+
+    def commit(self):
+        """Forgets everything which would only be needed to go back to an
+        earlier position in the input.  Must only be called when no state
+        is saved.
+
+        """
+        if self.memo is not None:
+            self.memo.clear()
+        self.scanner.commit()
+
+    def recall(self, prod, args):
+        """Looks up the outcome of calling the given production on the
+        given arguments at the current position.  Returns a pair of the
+        key under which the outcome is (or should be) remembered, and the
+        outcome (a (bool, result) pair), or None if it is not known.
+
+        """
+        buffer = self.scanner.get_buffer()
+        key = (prod, tuple([TermKey(a) for a in args]),
+               self.scanner.engines[-1].memo_key(),
+               buffer, buffer.position)
+        entry = self.memo.get(key)
+        if entry is None:
+            return (key, None)
+        (success, result, state) = entry
+        if self.listeners:
+            self.event('memo_hit', prod, result)
+        buffer.seek(state)
+        return (key, (success, result))
+
+    def remember(self, key, outcome):
+        buffer = key[3]
+        if self.scanner.get_buffer() is buffer:
+            (success, result) = outcome
+            self.memo.put(key, (success, result, buffer.tell()))
+
+    def interpret_memoized(self, prod, args):
+        (key, outcome) = self.recall(prod, args)
+        if outcome is not None:
+            return outcome
+        outcome = self.interpret(prod, args=args)
+        self.remember(key, outcome)
+        return outcome
+
+    def cannot_start(self, rule):
+        """Returns True if the Analyzer has determined that the given
+        rule cannot start with the upcoming token, and thus will fail,
+        without any effects, if it is tried.  (If anyone is listening, it
+        is always tried, so that they hear about it just the same.)
+
+        """
+        first = rule.first
+        if first is None or rule.nullable or self.listeners:
+            return False
+        return self.scanner.peek() not in first
+
     def interpret(self, ast, args=None):
         """Returns a pair (bool, result) where bool is True if it
         succeeded and False if it failed.
 
         """
-        self.event('interpret_ast', ast)
+        if self.listeners:
+            self.event('interpret_ast', ast)
         if isinstance(ast, Production):
             name = ast.name
-            bindings = False
             branch = None
-            for b in ast.branches:
-                formals = [self.interpret(f)[1] for f in b.formals]
-                self.event('call_args', formals, args)
-                if isinstance(formals, list):
-                    bindings = Term.match_all(formals, args)
-                    self.event('call_bindings', bindings)
-                    if bindings != False:
-                        branch = b
-                        break
+            # if anyone is listening, they hear about every branch tried,
+            # not just the ones the index says might match
+            if self.listeners:
+                branches = ast.branches
+            else:
+                branches = ast.candidates(args)
+            for b in branches:
+                if self.listeners:
+                    for f in b.formals:
+                        self.event('interpret_ast', f)
+                    self.event('call_args', b.get_patterns(), args)
+                matched = b.match(args)
+                if self.listeners:
+                    self.event('call_bindings',
+                        matched and dict(enumerate(b.unifier))
+                    )
+                if matched:
+                    branch = b
+                    break
                 # else:
                 #     self.event('call_newfangled_parsing_args', prod)
                 #     # start a new scope.  arg bindings will appear here.
@@ -116,14 +332,13 @@ class Interpreter(EventProducer):
                     (name, args)
                 )
 
-            self.context.push_scope(name)
-            if bindings != False:
-                for name in bindings.keys():
-                    self.context.store(name, bindings[name])
-            self.event('begin_interpret_rule', branch.body)
+            self.context.push_scope(name, branch.slot_names, branch.unifier)
+            if self.listeners:
+                self.event('begin_interpret_rule', branch.body)
             assert branch.body, repr(ast)
             (success, result) = self.interpret(branch.body)
-            self.event('end_interpret_rule', branch.body)
+            if self.listeners:
+                self.event('end_interpret_rule', branch.body)
             self.context.pop_scope(ast.name)
 
             return (success, result)
@@ -134,17 +349,23 @@ class Interpreter(EventProducer):
             (success, value_rhs) = self.interpret(ast.rhs)
             return (success, value_rhs)
         elif isinstance(ast, Or):
-            saved_context = self.context.clone()
+            if self.cannot_start(ast.lhs):
+                return self.interpret(ast.rhs)
+            self.context.save_state()
             self.scanner.save_state()
-            self.event('begin_or', ast.lhs, ast.rhs, saved_context)
+            if self.listeners:
+                self.event('begin_or', ast.lhs, ast.rhs, self.context.clone())
             (succeeded, result) = self.interpret(ast.lhs)
             if succeeded:
-                self.event('succeed_or', result)
+                if self.listeners:
+                    self.event('succeed_or', result)
+                self.context.pop_state()
                 self.scanner.pop_state()
                 return (True, result)
             else:
-                self.event('fail_or', self.context, self.scanner, result)
-                self.context = saved_context
+                if self.listeners:
+                    self.event('fail_or', self.context, self.scanner, result)
+                self.context.restore_state()
                 self.scanner.restore_state("after or")
                 return self.interpret(ast.rhs)
         elif isinstance(ast, Call):
@@ -156,20 +377,21 @@ class Interpreter(EventProducer):
                 assert isinstance(a, Term)
             if prodref.module == '$':
                 return tamsin.sysmod.call(name, self, args)
-            prod = self.program.find_production(prodref)
+            prod = ast.production or self.program.find_production(prodref)
             assert prod is not None, "unresolved: " + repr(prodref)
-            self.event('call_candidates', prod)
+            if self.listeners:
+                self.event('call_candidates', prod)
+            if self.memo is not None:
+                return self.interpret_memoized(prod, args)
             return self.interpret(prod, args=args)
         elif isinstance(ast, Send):
             (success, result) = self.interpret(ast.rule)
-            #(success, variable) = self.interpret(ast.pattern)  # ... ?
-            #self.context.store(variable.name, result)
-            formals = [self.interpret(f)[1] for f in [ast.pattern]]
-            bindings = Term.match_all(formals, [result])
-            if bindings == False:
+            if self.listeners:
+                self.event('interpret_ast', ast.pattern)
+            if not ast.match(result):
                 return (False, Atom('nomatch'))
-            for name in bindings.keys():
-                self.context.store(name, bindings[name])
+            for slot in ast.slots:
+                self.context.store(slot, ast.unifier[slot])
             return (success, result)
         elif isinstance(ast, Using):
             sub = ast.rule
@@ -180,20 +402,23 @@ class Interpreter(EventProducer):
             elif prodref.module == '$' and scanner_name == 'utf8':
                 new_engine = UTF8ScannerEngine()
             else:
-                prod = self.program.find_production(prodref)
+                prod = ast.production or self.program.find_production(prodref)
                 if not prod:
                     raise ValueError("No such scanner '%s'" % scanner_name)
                 new_engine = ProductionScannerEngine(self, prod)
             self.scanner.push_engine(new_engine)
-            self.event('enter_with')
+            if self.listeners:
+                self.event('enter_with')
             (succeeded, result) = self.interpret(sub)
-            self.event('leave_with', succeeded, result)
+            if self.listeners:
+                self.event('leave_with', succeeded, result)
             self.scanner.pop_engine()
             return (succeeded, result)
         elif isinstance(ast, On):
             (success, result) = self.interpret(ast.texpr)
             buffer = str(result.expand(self.context))
-            self.event('interpret_on_buffer', buffer)
+            if self.listeners:
+                self.event('interpret_on_buffer', buffer)
             previous_buffer = self.scanner.get_buffer()
             self.scanner.install_buffer(StringBuffer(buffer))
             (success, result) = self.interpret(ast.rule)
@@ -203,46 +428,51 @@ class Interpreter(EventProducer):
             (success, variable) = self.interpret(ast.variable)
             (success, term) = self.interpret(ast.texpr)
             result = term.expand(self.context)
-            self.context.store(variable.name, result)
+            self.context.store(variable.slot, result)
             return (True, result)
         elif isinstance(ast, Not):
             expr = ast.rule
-            saved_context = self.context.clone()
+            self.context.save_state()
             self.scanner.save_state()
-            self.event('begin_not', expr, saved_context)
+            if self.listeners:
+                self.event('begin_not', expr, self.context.clone())
             (succeeded, result) = self.interpret(expr)
-            self.context = saved_context
+            self.context.restore_state()
             self.scanner.restore_state("after not")
             if succeeded:
-                return (False, Atom(self.scanner.error_message(
+                return (False, self.scanner.failure(
                     "anything else", self.scanner.peek()
-                )))
+                ))
             else:
-                return (True, Atom('nil'))
+                return (True, NIL)
         elif isinstance(ast, While):
-            result = Atom('nil')
-            self.event('begin_while')
+            result = NIL
+            if self.listeners:
+                self.event('begin_while')
             succeeded = True
             successful_result = result
             while succeeded:
-                saved_context = self.context.clone()
+                self.context.save_state()
                 self.scanner.save_state()
                 (succeeded, result) = self.interpret(ast.rule)
                 if succeeded:
+                    self.context.pop_state()
                     self.scanner.pop_state()
                     successful_result = result
-                    self.event('repeating_while', result)
+                    if self.listeners:
+                        self.event('repeating_while', result)
                 else:
+                    self.context.restore_state()
                     self.scanner.restore_state("after while")
-            self.context = saved_context
-            self.event('end_while', result)
+            if self.listeners:
+                self.event('end_while', result)
             return (True, successful_result)
         elif isinstance(ast, Concat):
             (success, lhs) = self.interpret(ast.lhs)
-            lhs = str(lhs.expand(self.context))
+            lhs = lhs.expand(self.context)
             (success, rhs) = self.interpret(ast.rhs)
-            rhs = str(rhs.expand(self.context))
-            return (True, Atom(lhs + rhs))
+            rhs = rhs.expand(self.context)
+            return (True, concat(lhs, rhs))
         elif isinstance(ast, TermNode):
             return (True, ast.to_term())
         else:
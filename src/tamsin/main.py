@@ -7,7 +7,7 @@ import os
 import subprocess
 import sys
 
-from tamsin.buffer import FileBuffer, StringBuffer
+from tamsin.buffer import buffer_for_file
 from tamsin.event import DebugEventListener
 from tamsin.term import Atom
 from tamsin.scanner import (
@@ -15,6 +15,8 @@ from tamsin.scanner import (
 )
 from tamsin.parser import Parser
 from tamsin.interpreter import Interpreter
+from tamsin.closure import ClosureInterpreter
+from tamsin.stack import StackInterpreter
 from tamsin.desugarer import Desugarer
 from tamsin.analyzer import Analyzer
 from tamsin.compiler import Compiler  # to be replaced by...
@@ -22,11 +24,26 @@ from tamsin.codegen import CodeGen
 from tamsin.backends.c import Emitter
 
 
+# number of production calls remembered by --packrat, unless otherwise given
+DEFAULT_MEMO_SIZE = 100000
+
+# execution engines which may be selected with --engine
+ENGINES = {
+    'tree': Interpreter,
+    'closure': ClosureInterpreter,
+    'stack': StackInterpreter,
+}
+
+
+def usage_error(message):
+    sys.stderr.write("tamsin: %s\n" % message)
+    sys.exit(2)
+
+
 def parse(filename):
     with open(filename, 'r') as f:
         scanner = Scanner(
-            FileBuffer(f, filename=filename),
-            #StringBuffer(f.read(), filename=filename),
+            buffer_for_file(f, filename=filename),
             engines=(TamsinScannerEngine(),)
         )
         parser = Parser(scanner)
@@ -49,40 +66,79 @@ def parse_and_check_args(args):
     return ast
 
 
-def run(ast, listeners=None):
+def run(ast, listeners=None, memo_size=None, engine='tree', stats=False,
+        stream=None):
+    """If `stream` is given, it names a production which is applied to
+    the input over and over, printing each result as soon as it is
+    produced, instead of applying `main` once to the whole input.
+
+    """
     scanner = Scanner(
-        FileBuffer(sys.stdin, filename='<stdin>'),
-        #StringBuffer(sys.stdin.read(), filename='<stdin>'),
+        buffer_for_file(sys.stdin, filename='<stdin>'),
         engines=(UTF8ScannerEngine(),),
         listeners=listeners
     )
-    interpreter = Interpreter(
-        ast, scanner, listeners=listeners
+    interpreter = ENGINES[engine](
+        ast, scanner, listeners=listeners, memo_size=memo_size
     )
-    (succeeded, result) = interpreter.interpret_program(ast)
-    if not succeeded:
-        sys.stderr.write(str(result) + "\n")
-        sys.exit(1)
-    print str(result)
+    if stream is None:
+        outcomes = [interpreter.interpret_program(ast)]
+    else:
+        outcomes = interpreter.interpret_records(ast, stream)
+    for (succeeded, result) in outcomes:
+        if not succeeded:
+            if stats:
+                interpreter.write_stats(sys.stderr)
+            sys.stderr.write(str(result) + "\n")
+            sys.exit(1)
+        result.write(sys.stdout)
+        sys.stdout.write("\n")
+        if stream is not None:
+            sys.stdout.flush()
+    if stats:
+        interpreter.write_stats(sys.stderr)
 
 
 def main(args, tamsin_dir='.'):
     listeners = []
-    if args[0] == '--debug':
-        listeners.append(DebugEventListener())
+    memo_size = None
+    engine = 'tree'
+    stats = False
+    stream = None
+    while args[0].startswith('--'):
+        if args[0] == '--debug':
+            listeners.append(DebugEventListener())
+        elif args[0] == '--stats':
+            stats = True
+        elif args[0] == '--packrat':
+            memo_size = DEFAULT_MEMO_SIZE
+        elif args[0].startswith('--packrat='):
+            size = args[0][len('--packrat='):]
+            if not size.isdigit() or int(size) == 0:
+                usage_error("--packrat=N needs a positive number, not '%s'" %
+                            size)
+            memo_size = int(size)
+        elif args[0].startswith('--stream='):
+            stream = args[0][len('--stream='):]
+        elif args[0].startswith('--engine='):
+            engine = args[0][len('--engine='):]
+            if engine not in ENGINES:
+                usage_error("unknown engine '%s'" % engine)
+        else:
+            usage_error("unknown option '%s'" % args[0])
         args = args[1:]
     if args[0] == 'scan':
         with open(args[1], 'r') as f:
             scanner = Scanner(
-                FileBuffer(f, filename=args[1]),
+                buffer_for_file(f, filename=args[1]),
                 engines=(TamsinScannerEngine(),),
                 listeners=listeners
             )
-        tok = None
-        while tok is not EOF:
-            tok = scanner.scan()
-            if tok is not EOF:
-                print Atom(tok).repr()
+            tok = None
+            while tok is not EOF:
+                tok = scanner.scan()
+                if tok is not EOF:
+                    print Atom(tok).repr()
         print
     elif args[0] == 'parse':
         parser = Parser.for_file(args[1])
@@ -145,4 +201,5 @@ def main(args, tamsin_dir='.'):
         sys.exit(exit_code)
     else:
         ast = parse_and_check_args(args)
-        run(ast, listeners=listeners)
+        run(ast, listeners=listeners, memo_size=memo_size, engine=engine,
+            stats=stats, stream=stream)
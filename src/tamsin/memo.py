@@ -0,0 +1,45 @@
+# encoding: UTF-8
+
+# Copyright (c)2014 Chris Pressey, Cat's Eye Technologies.
+# Distributed under a BSD-style license; see LICENSE for more information.
+
+from collections import OrderedDict
+
+
+class MemoTable(object):
+    """A bounded table of memoized results.  When it is full, the entry
+    which was least recently used is evicted to make room for a new one.
+
+    """
+    def __init__(self, capacity):
+        assert capacity > 0
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "MemoTable(%r)" % self.capacity
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Returns the value stored under key, or None if there is none."""
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        assert value is not None
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
@@ -9,7 +9,7 @@ from tamsin.ast import (
     Send, Set, Concat, Using, On, Fold,
     AtomNode, VariableNode, ConstructorNode,
 )
-from tamsin.buffer import FileBuffer
+from tamsin.buffer import buffer_for_file
 from tamsin.event import EventProducer
 from tamsin.scanner import (
     EOF, Scanner, TamsinScannerEngine
@@ -30,13 +30,15 @@ class Parser(EventProducer):
 
     @classmethod
     def for_file(class_, filename):
-        with open(filename, 'r') as f:
-            return Parser(
-                Scanner(
-                    FileBuffer(f, filename=filename),
-                    engines=(TamsinScannerEngine(),),
-                )
+        # the file is not closed here, as the parser may have yet to read
+        # it; the buffer closes it once it no longer needs it
+        f = open(filename, 'r')
+        return Parser(
+            Scanner(
+                buffer_for_file(f, filename=filename, close=True),
+                engines=(TamsinScannerEngine(),),
             )
+        )
 
     def eof(self):
         return self.scanner.eof()
@@ -3,14 +3,38 @@
 # Copyright (c)2014 Chris Pressey, Cat's Eye Technologies.
 # Distributed under a BSD-style license; see LICENSE for more information.
 
+import re
+
 from tamsin.buffer import Buffer
 from tamsin.event import EventProducer
-from tamsin.term import Term
+from tamsin.term import Term, LazyAtom
 
 
 EOF = object()
 
 
+def format_error(expected, found, line_number, column_number, filename):
+    if found is EOF:
+        found = 'EOF'
+    else:
+        found = "'%s'" % found
+    return (
+        "expected %s but found %s at line %s, column %s in '%s'" %
+        (expected, found, line_number, column_number, filename)
+    )
+
+
+def format_failure(expected, found, buffer, position, lines):
+    """Like format_error, but works out the line and column number of
+    the given position in the buffer first.  `lines` is the buffer's
+    LineIndex at the time (see Buffer.line_and_column.)
+
+    """
+    (line_number, column_number) = buffer.line_and_column(position, lines)
+    return format_error(expected, found, line_number, column_number,
+                        buffer.filename)
+
+
 class Scanner(EventProducer):
     def __init__(self, buffer, engines=None, listeners=None):
         """Create a new Scanner object.
@@ -21,13 +45,19 @@ class Scanner(EventProducer):
         assert isinstance(buffer, Buffer)
         self.buffer = buffer
         self.engines = []
+        # the last token scanned by peek(): where it was scanned (the
+        # buffer, position, and engine), the token, and the state of the
+        # buffer just after it
+        self.peeked_at = None
+        self.peeked = None
+        self.peeked_end = None
         if engines is not None:
             for engine in engines:
                 self.push_engine(engine)
 
     def __repr__(self):
         return "Scanner(%r, position=%r)" % (
-            self.buffer, self.position
+            self.buffer, self.buffer.position
         )
 
     def get_buffer(self):
@@ -59,6 +89,9 @@ class Scanner(EventProducer):
     def pop_state(self):
         return self.buffer.pop_state()
 
+    def commit(self):
+        return self.buffer.commit()
+
     def chop(self, amount):
         """Returns amount characters from the buffer and advances the
         scan position by amount.
@@ -78,6 +111,43 @@ class Scanner(EventProducer):
         """
         return self.buffer.first(amount)
 
+    def span(self, pattern):
+        """Returns how many characters at the front of the buffer the
+        compiled regular expression `pattern` matches.  Does not advance
+        the scan position.
+
+        Should only be used by ScannerEngines.
+
+        """
+        return self.buffer.span(pattern)
+
+    def span_tokens(self, pattern, accept):
+        """Consumes the longest run of tokens for which `accept` returns
+        True, and returns them all concatenated together (which may be
+        the empty string.)
+
+        If it is not None, `pattern` should be a compiled regular
+        expression which matches only runs of ASCII characters which
+        `accept` would accept.  When the current engine scans each
+        character as a token, such runs are chopped off in one go instead
+        of being scanned one token at a time.
+
+        """
+        bulk = (pattern is not None and
+                self.engines[-1].__class__ in CHARACTER_ENGINES)
+        buffer = self.buffer
+        parts = []
+        while True:
+            if bulk:
+                n = buffer.span(pattern)
+                if n:
+                    parts.append(buffer.chop(n))
+            token = self.peek()
+            if token is EOF or not accept(token):
+                break
+            parts.append(self.scan())
+        return ''.join(parts)
+
     def is_at_eof(self):
         """Returns True iff there is no more input to scan.
 
@@ -114,16 +184,22 @@ class Scanner(EventProducer):
         return self.first(1).isalnum()
 
     def error_message(self, expected, found):
-        if found is EOF:
-            found = 'EOF'
-        else:
-            found = "'%s'" % found
-        return (
-            "expected %s but found %s at line %s, column %s in '%s'" %
-            (expected, found,
-             self.buffer.line_number,
-             self.buffer.column_number,
-             self.buffer.filename)
+        return format_error(expected, found,
+            self.buffer.line_number,
+            self.buffer.column_number,
+            self.buffer.filename
+        )
+
+    def failure(self, expected, found):
+        """Returns an Atom whose text is the same as error_message would
+        return, but which is only formatted if it is ever looked at.
+        Only the position is noted here; the line and column number are
+        not worked out until then.
+
+        """
+        buffer = self.buffer
+        return LazyAtom(format_failure, expected, found,
+            buffer, buffer.position, buffer.lines
         )
 
     def error(self, expected, found):
@@ -139,31 +215,46 @@ class Scanner(EventProducer):
         containing UTF-8 sequences, possibly not.
 
         """
-        token = self.engines[-1].scan_impl(self)
-        #import sys
-        #print >>sys.stderr, token
-        assert not isinstance(token, unicode), repr(token)
-        self.event('scanned', self, token)
+        token = self.peek()
+        self.buffer.seek(self.peeked_end)
         return token
 
     def peek(self):
-        self.buffer.save_state()
-        token = self.scan()
-        self.buffer.restore_state()
-        return token
+        """Returns the next token from the buffer, without consuming it.
+
+        The token is remembered, so that peeking at it again, or then
+        scanning or consuming it, does not scan it all over again (which,
+        for a ProductionScannerEngine, would mean running a production.)
+        If anyone is listening, though, the token is scanned every time, so
+        that they hear about it every time.
+
+        """
+        buffer = self.buffer
+        at = (buffer, buffer.position, self.engines[-1])
+        if at != self.peeked_at or self.listeners:
+            buffer.save_state()
+            token = self.engines[-1].scan_impl(self)
+            assert not isinstance(token, unicode), repr(token)
+            if self.listeners:
+                self.event('scanned', self, token)
+            end = buffer.tell()
+            buffer.restore_state()
+            self.peeked_at = at
+            self.peeked = token
+            self.peeked_end = end
+        return self.peeked
 
     def consume(self, t):
         if isinstance(t, unicode):
             t = t.encode('UTF-8')
         assert not isinstance(t, unicode)
-        self.event('consume', t)
-        self.buffer.save_state()
-        s = self.scan()
+        if self.listeners:
+            self.event('consume', t)
+        s = self.peek()
         if s == t:
-            self.buffer.pop_state()
+            self.buffer.seek(self.peeked_end)
             return t
         else:
-            self.buffer.restore_state()
             return None
 
     def expect(self, t):
@@ -183,6 +274,13 @@ class ScannerEngine(object):
         """Should always return a non-Unicode string."""
         raise NotImplementedError
 
+    def memo_key(self):
+        """Returns a value which is equal for any two engines which will
+        always scan the same input into the same tokens.
+
+        """
+        return self.__class__
+
 
 CLOSE_QUOTE = {
     '"': '"',
@@ -199,59 +297,81 @@ ESCAPE_SEQUENCE = {
 }
 
 
+# whitespace and comments, which come between tokens
+BLANKS = re.compile(r'(?:[ \t\r\n]+|#[^\n]*\n?)+')
+
+IDENTIFIER = re.compile(r'[a-zA-Z0-9][a-zA-Z0-9_]*')
+
+DIGRAPHS = frozenset(('&&', '||', '->', '<-', '<<', '>>'))
+
+PUNCTUATION = frozenset('=()[]{}!:/|&,.@+$')
+
+ARROWS = frozenset(c.encode('UTF-8') for c in (u'→', u'←', u'«', u'»'))
+
+OPEN_FANCY_QUOTE = u'“'.encode('UTF-8')
+CLOSE_FANCY_QUOTE = u'”'.encode('UTF-8')
+
+
 class TamsinScannerEngine(ScannerEngine):
+    """Runs of whitespace and comments, identifiers, and the plain
+    characters in quoted strings are each matched by a regular expression
+    and chopped off in one go, rather than one character at a time.
+
+    """
+    # for each closing quote, a regular expression matching a run of
+    # characters which neither start an escape sequence nor could be the
+    # start of the closing quote
+    PLAIN = dict(
+        (close, re.compile(r'[^\\%s]+' % re.escape(close[0])))
+        for close in CLOSE_QUOTE.values() + [CLOSE_FANCY_QUOTE]
+    )
+
     def scan_impl(self, scanner):
-        while not scanner.is_at_eof() and scanner.startswith(('#', ' ', '\t', '\r', '\n')):
-            while not scanner.is_at_eof() and scanner.startswith((' ', '\t', '\r', '\n')):
-                scanner.chop(1)
-            while not scanner.is_at_eof() and scanner.startswith(('#',)):
-                while not scanner.is_at_eof() and not scanner.startswith(('\n',)):
-                    scanner.chop(1)
-                if not scanner.is_at_eof():
-                    scanner.chop(1)
+        n = scanner.span(BLANKS)
+        if n:
+            scanner.chop(n)
 
         if scanner.is_at_eof():
             return EOF
 
-        if scanner.startswith(('&&', '||', '->', '<-', '<<', '>>')):
+        two = scanner.first(2)
+        if two in DIGRAPHS:
             return scanner.chop(2)
 
-        c = scanner.is_at_utf8()
-        if c > 0:
-            c = scanner.chop(c).decode('UTF-8')
-            if c in (u'→', u'←', u'«', u'»'):
-                return c.encode('UTF-8')
-            elif c == u'“':
-                return self.consume_quoted(scanner,
-                    u'“'.encode('UTF-8'), u'”'.encode('UTF-8')
-                )
-            else:
-                scanner.error('identifiable character', scanner.first(1))
-
-        if scanner.startswith(('=', '(', ')', '[', ']', '{', '}', '!', ':', '/',
-                            '|', '&', ',', '.', '@', '+', '$',
-                            )):
+        c = two[0]
+        if c in PUNCTUATION:
             return scanner.chop(1)
 
-        for quote in (CLOSE_QUOTE.keys()):
-            if scanner.startswith(quote):
-                scanner.chop(len(quote))
-                return self.consume_quoted(scanner, quote, CLOSE_QUOTE[quote])
+        if c in CLOSE_QUOTE:
+            scanner.chop(1)
+            return self.consume_quoted(scanner, c, CLOSE_QUOTE[c])
 
-        if scanner.isalnum():
-            token = ''
-            while not scanner.is_at_eof() and (scanner.isalnum() or
-                                               scanner.startswith(('_',))):
-                token += scanner.chop(1)
-            return token
+        n = scanner.span(IDENTIFIER)
+        if n:
+            return scanner.chop(n)
+
+        n = scanner.is_at_utf8()
+        if n > 0:
+            c = scanner.chop(n)
+            if c in ARROWS:
+                return c
+            elif c == OPEN_FANCY_QUOTE:
+                return self.consume_quoted(scanner,
+                    OPEN_FANCY_QUOTE, CLOSE_FANCY_QUOTE
+                )
 
         scanner.error('identifiable character', scanner.first(1))
 
     def consume_quoted(self, scanner, quote, close_quote):
         # assumes the start quote has already been chopped
-        token = quote
-        while (not scanner.is_at_eof() and
-               not scanner.startswith(close_quote)):
+        plain = self.PLAIN[close_quote]
+        token = [quote]
+        while True:
+            n = scanner.span(plain)
+            if n:
+                token.append(scanner.chop(n))
+            if scanner.is_at_eof() or scanner.startswith((close_quote,)):
+                break
             char = scanner.chop(1)
             if char == '\\':
                 char = scanner.chop(1)
@@ -261,11 +381,11 @@ class TamsinScannerEngine(ScannerEngine):
                     char = chr(int(scanner.chop(2), 16))
                 else:
                     scanner.error('legal escape sequence', '\\' + char)
-            token += char
+            token.append(char)
         scanner.chop(len(close_quote))  # chop ending quote
         # we add the specific close quote we expect, in case it was EOF
-        token += close_quote
-        return token
+        token.append(close_quote)
+        return ''.join(token)
 
 
 class UTF8ScannerEngine(ScannerEngine):
@@ -293,8 +413,49 @@ class ProductionScannerEngine(ScannerEngine):
     def __init__(self, interpreter, production):
         self.interpreter = interpreter
         self.production = production
+        # the engine the production runs under.  It has no state, so one
+        # will do for every token this engine scans
+        self.engine = UTF8ScannerEngine()
+        # tokens already scanned in self.buffer: a dict from position
+        # to (token, state of the buffer just after the token)
+        self.buffer = None
+        self.tokens = {}
+        # positions before this have been discarded from self.tokens
+        self.floor = 0
+
+    def memo_key(self):
+        return (self.__class__, self.production)
 
     def scan_impl(self, scanner):
+        if scanner.listeners:
+            # so that they hear about the production being run every time
+            return self.scan_production(scanner)
+        buffer = scanner.get_buffer()
+        if buffer is not self.buffer:
+            self.buffer = buffer
+            self.tokens = {}
+            self.floor = 0
+        entry = self.tokens.get(buffer.position)
+        if entry is not None:
+            (token, state) = entry
+            buffer.seek(state)
+            return token
+        position = buffer.position
+        token = self.scan_production(scanner)
+        self.trim_tokens(buffer)
+        self.tokens[position] = (token, buffer.tell())
+        return token
+
+    def trim_tokens(self, buffer):
+        """Forget the tokens at positions which the buffer can no longer
+        return to."""
+        floor = buffer.earliest_position()
+        if floor > self.floor:
+            for position in [p for p in self.tokens if p < floor]:
+                del self.tokens[position]
+            self.floor = floor
+
+    def scan_production(self, scanner):
         if scanner.is_at_eof():
             return EOF
 
@@ -305,7 +466,7 @@ class ProductionScannerEngine(ScannerEngine):
         assert scanner is self.interpreter.scanner
 
         # default to this so you don't shoot yourself in the foot
-        scanner.push_engine(UTF8ScannerEngine())
+        scanner.push_engine(self.engine)
 
         result = self.interpreter.interpret(self.production)
         (success, token) = result
@@ -313,10 +474,17 @@ class ProductionScannerEngine(ScannerEngine):
         scanner.pop_engine()
 
         if success:
-            self.interpreter.event('production_scan', self.production, token)
+            if self.interpreter.listeners:
+                self.interpreter.event(
+                    'production_scan', self.production, token
+                )
             assert isinstance(token, Term), repr(token)
             if token is EOF:
                 return token
             return str(token)
         else:
             return EOF
+
+
+# engines which scan every ASCII character as a token by itself
+CHARACTER_ENGINES = (UTF8ScannerEngine, ByteScannerEngine)
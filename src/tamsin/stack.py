@@ -0,0 +1,221 @@
+# encoding: UTF-8
+
+# Copyright (c)2014 Chris Pressey, Cat's Eye Technologies.
+# Distributed under a BSD-style license; see LICENSE for more information.
+
+# An execution engine which has the same behaviour as tamsin.interpreter,
+# but which does not use the Python call stack to execute nested rules.
+# Instead, each AST node is executed by a Python generator, which yields
+# the generators for the nodes it wants executed, and then yields its own
+# result; a driver loop keeps the generators which are waiting on a result
+# in an explicit stack.  So how deeply productions may call each other is
+# limited only by available memory, not by Python's recursion limit.
+
+
+from tamsin.ast import (
+    Production, And, Or, Not, While, Call, Send, Set, Using, On,
+    Concat, AtomNode, VariableNode, PatternVariableNode, ConstructorNode
+)
+from tamsin.buffer import StringBuffer
+from tamsin.term import Atom, NIL, concat
+from tamsin.interpreter import Interpreter
+from tamsin.scanner import (
+    ByteScannerEngine, UTF8ScannerEngine, ProductionScannerEngine
+)
+import tamsin.sysmod
+
+
+class StackInterpreter(Interpreter):
+    """Like the ClosureInterpreter, this does not announce an event for
+    each AST node that it executes.
+
+    """
+    def __init__(self, program, scanner, listeners=None, memo_size=None):
+        Interpreter.__init__(self, program, scanner,
+                             listeners=listeners, memo_size=memo_size)
+        self.executors = {
+            Production: self.execute_production,
+            And: self.execute_and,
+            Or: self.execute_or,
+            Not: self.execute_not,
+            While: self.execute_while,
+            Call: self.execute_call,
+            Send: self.execute_send,
+            Set: self.execute_set,
+            Using: self.execute_using,
+            On: self.execute_on,
+            Concat: self.execute_concat,
+            AtomNode: self.execute_term,
+            VariableNode: self.execute_term,
+            PatternVariableNode: self.execute_term,
+            ConstructorNode: self.execute_term,
+        }
+
+    def __repr__(self):
+        return "StackInterpreter(%r, %r, %r)" % (
+            self.program, self.scanner, self.context
+        )
+
+    def interpret(self, ast, args=None):
+        stack = [self.execute(ast, args)]
+        value = None
+        while True:
+            item = stack[-1].send(value)
+            if type(item) is tuple:
+                # the generator on top of the stack has produced its result
+                stack.pop()
+                if not stack:
+                    return item
+                value = item
+            else:
+                stack.append(item)
+                value = None
+
+    def execute(self, ast, args=None):
+        """Returns a generator which executes the given AST node.  It
+        yields a generator for each sub-rule it needs executed (and is
+        sent the (bool, result) pair of that sub-rule in return), and
+        finally yields its own (bool, result) pair.
+
+        """
+        try:
+            executor = self.executors[ast.__class__]
+        except KeyError:
+            raise NotImplementedError(repr(ast))
+        if ast.__class__ is Production:
+            return executor(ast, args)
+        return executor(ast)
+
+    def evaluate(self, ast):
+        """Evaluates the given term expression, expanding its variables."""
+        if isinstance(ast, Concat):
+            return concat(self.evaluate(ast.lhs), self.evaluate(ast.rhs))
+        return ast.to_term().expand(self.context)
+
+    def execute_production(self, ast, args):
+        branch = None
+        for b in ast.candidates(args):
+            if b.match(args):
+                branch = b
+                break
+        if branch is None:
+            raise ValueError("No '%s' production matched arguments %r" %
+                (ast.name, args)
+            )
+        self.context.push_scope(ast.name, branch.slot_names, branch.unifier)
+        result = yield self.execute(branch.body)
+        self.context.pop_scope(ast.name)
+        yield result
+
+    def execute_and(self, ast):
+        (success, result) = yield self.execute(ast.lhs)
+        if not success:
+            yield (False, result)
+        else:
+            yield (yield self.execute(ast.rhs))
+
+    def execute_or(self, ast):
+        if self.cannot_start(ast.lhs):
+            yield (yield self.execute(ast.rhs))
+            return
+        self.context.save_state()
+        self.scanner.save_state()
+        (succeeded, result) = yield self.execute(ast.lhs)
+        if succeeded:
+            self.context.pop_state()
+            self.scanner.pop_state()
+            yield (True, result)
+        else:
+            self.context.restore_state()
+            self.scanner.restore_state("after or")
+            yield (yield self.execute(ast.rhs))
+
+    def execute_call(self, ast):
+        prodref = ast.prodref
+        args = [self.evaluate(x) for x in ast.args]
+        if prodref.module == '$':
+            yield tamsin.sysmod.call(prodref.name, self, args)
+            return
+        prod = ast.production or self.program.find_production(prodref)
+        assert prod is not None, "unresolved: " + repr(prodref)
+        if self.memo is None:
+            yield (yield self.execute_production(prod, args))
+            return
+        (key, outcome) = self.recall(prod, args)
+        if outcome is None:
+            outcome = yield self.execute_production(prod, args)
+            self.remember(key, outcome)
+        yield outcome
+
+    def execute_send(self, ast):
+        (success, result) = yield self.execute(ast.rule)
+        if not ast.match(result):
+            yield (False, Atom('nomatch'))
+            return
+        for slot in ast.slots:
+            self.context.store(slot, ast.unifier[slot])
+        yield (success, result)
+
+    def execute_using(self, ast):
+        prodref = ast.prodref
+        if prodref.module == '$' and prodref.name == 'byte':
+            new_engine = ByteScannerEngine()
+        elif prodref.module == '$' and prodref.name == 'utf8':
+            new_engine = UTF8ScannerEngine()
+        else:
+            prod = ast.production or self.program.find_production(prodref)
+            if not prod:
+                raise ValueError("No such scanner '%s'" % prodref.name)
+            new_engine = ProductionScannerEngine(self, prod)
+        self.scanner.push_engine(new_engine)
+        (succeeded, result) = yield self.execute(ast.rule)
+        self.scanner.pop_engine()
+        yield (succeeded, result)
+
+    def execute_on(self, ast):
+        buffer = str(self.evaluate(ast.texpr))
+        previous_buffer = self.scanner.get_buffer()
+        self.scanner.install_buffer(StringBuffer(buffer))
+        (success, result) = yield self.execute(ast.rule)
+        self.scanner.install_buffer(previous_buffer)
+        yield (success, result)
+
+    def execute_set(self, ast):
+        result = self.evaluate(ast.texpr)
+        self.context.store(ast.variable.slot, result)
+        yield (True, result)
+
+    def execute_not(self, ast):
+        self.context.save_state()
+        self.scanner.save_state()
+        (succeeded, result) = yield self.execute(ast.rule)
+        self.context.restore_state()
+        self.scanner.restore_state("after not")
+        if succeeded:
+            yield (False, self.scanner.failure(
+                "anything else", self.scanner.peek()
+            ))
+        else:
+            yield (True, NIL)
+
+    def execute_while(self, ast):
+        successful_result = NIL
+        succeeded = True
+        while succeeded:
+            self.context.save_state()
+            self.scanner.save_state()
+            (succeeded, result) = yield self.execute(ast.rule)
+            if succeeded:
+                self.context.pop_state()
+                self.scanner.pop_state()
+                successful_result = result
+            else:
+                self.context.restore_state()
+                self.scanner.restore_state("after while")
+        yield (True, successful_result)
+
+    def execute_concat(self, ast):
+        yield (True, self.evaluate(ast))
+
+    def execute_term(self, ast):
+        yield (True, ast.to_term())
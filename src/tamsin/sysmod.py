@@ -5,27 +5,32 @@
 
 # Python version of Tamsin's $ module.
 
+import re
 import sys
 
-from tamsin.term import Atom, Constructor
+from tamsin.term import (
+    Atom, LazyAtom, atom, constructor, make_list, list_elements,
+    count_elements, NIL
+)
 from tamsin.scanner import EOF
 
 
 TRANSLATOR = {'return': 'return_', 'print': 'print_'}
 
 
-def call(name, interpreter, args):
+def lookup(name):
     name = TRANSLATOR.get(name, name)
     if name not in globals():
         raise NotImplementedError(name)
-    return globals()[name](interpreter, args)
+    return globals()[name]
+
+
+def call(name, interpreter, args):
+    return lookup(name)(interpreter, args)
 
 
 def arity(name):
-    name = TRANSLATOR.get(name, name)
-    if name not in globals():
-        raise NotImplementedError(name)
-    return globals()[name].arity
+    return lookup(name).arity
 
 
 def return_(self, args):
@@ -46,27 +51,27 @@ def expect(self, args):
         return (True, term)
     else:
         return (False,
-            Atom(self.scanner.error_message("'%s'" % token, upcoming_token))
+            self.scanner.failure("'%s'" % token, upcoming_token)
         )
 expect.arity = 1
 
 
 def eof(self, args):
     if self.scanner.peek() is EOF:
-        return (True, '')
+        return (True, atom(''))
     else:
         return (False,
-            Atom(self.scanner.error_message('EOF', self.scanner.peek()))
+            self.scanner.failure('EOF', self.scanner.peek())
         )
 eof.arity = 0
 
 
 def any(self, args):
     if self.scanner.peek() is not EOF:
-        return (True, Atom(self.scanner.scan()))
+        return (True, atom(self.scanner.scan()))
     else:
         return (False,
-            Atom(self.scanner.error_message('any token', EOF))
+            self.scanner.failure('any token', EOF)
         )
 any.arity = 0
 
@@ -74,10 +79,10 @@ any.arity = 0
 def alnum(self, args):
     if (self.scanner.peek() is not EOF and
         self.scanner.peek()[0].isalnum()):
-        return (True, Atom(self.scanner.scan()))
+        return (True, atom(self.scanner.scan()))
     else:
         return (False,
-            Atom(self.scanner.error_message('alphanumeric', self.scanner.peek()))
+            self.scanner.failure('alphanumeric', self.scanner.peek())
         )
 alnum.arity = 0
 
@@ -85,10 +90,10 @@ alnum.arity = 0
 def upper(self, args):
     if (self.scanner.peek() is not EOF and
         self.scanner.peek()[0].isupper()):
-        return (True, Atom(self.scanner.scan()))
+        return (True, atom(self.scanner.scan()))
     else:
         return (False,
-            Atom(self.scanner.error_message('uppercase', self.scanner.peek()))
+            self.scanner.failure('uppercase', self.scanner.peek())
         )
 upper.arity = 0
 
@@ -96,16 +101,68 @@ upper.arity = 0
 def startswith(self, args):
     if (self.scanner.peek() is not EOF and
         self.scanner.peek()[0].startswith((str(args[0]),))):
-        return (True, Atom(self.scanner.scan()))
+        return (True, atom(self.scanner.scan()))
     else:
         return (False,
-            Atom(self.scanner.error_message("'%s...'" % args[0], self.scanner.peek()))
+            self.scanner.failure("'%s...'" % args[0], self.scanner.peek())
         )
 startswith.arity = 1
 
 
+_ALNUMS = re.compile(r'[a-zA-Z0-9]+')
+
+
+def span_alnum(self, args):
+    return (True, atom(self.scanner.span_tokens(
+        _ALNUMS, lambda token: token[:1].isalnum()
+    )))
+span_alnum.arity = 0
+
+
+def span_until(self, args):
+    stop = str(args[0])
+    pattern = None
+    if len(stop) == 1 and stop < '\x80':
+        pattern = re.compile('[^%s\x80-\xff]+' % re.escape(stop))
+    return (True, atom(self.scanner.span_tokens(
+        pattern, lambda token: token != stop
+    )))
+span_until.arity = 1
+
+
+def span_in(self, args):
+    members = _characters(str(args[0]))
+    ascii = [c for c in members if c < '\x80']
+    pattern = None
+    if ascii:
+        pattern = re.compile('[%s]+' % ''.join(re.escape(c) for c in ascii))
+    return (True, atom(self.scanner.span_tokens(
+        pattern, lambda token: token in members
+    )))
+span_in.arity = 1
+
+
+def _characters(text):
+    """Returns the set of (UTF-8) characters in the given string."""
+    members = set()
+    i = 0
+    while i < len(text):
+        k = ord(text[i])
+        if k & 0b11100000 == 0b11000000:
+            n = 2
+        elif k & 0b11110000 == 0b11100000:
+            n = 3
+        elif k & 0b11111000 == 0b11110000:
+            n = 4
+        else:
+            n = 1
+        members.add(text[i:i + n])
+        i += n
+    return members
+
+
 def equal(self, args):
-    if args[0].match(args[1]) != False:
+    if args[0].equals(args[1]):
         return (True, args[0])
     else:
         return (False, Atom("term '%s' does not equal '%s'" %
@@ -129,13 +186,9 @@ unquote.arity = 3
 
 def mkterm(self, args):
     t = args[0]
-    l = args[1]
-    contents = []
-    while isinstance(l, Constructor) and l.tag == 'list':
-        contents.append(l.contents[0])
-        l = l.contents[1]
+    (contents, tail) = list_elements(args[1])
     if contents:
-        return (True, Constructor(t.text, contents))
+        return (True, constructor(t.text, contents))
     else:
         return (True, t)
 mkterm.arity = 2
@@ -148,7 +201,7 @@ reverse.arity = 2
 
 def print_(self, args):
     val = args[0]
-    sys.stdout.write(str(val))
+    val.write(sys.stdout)
     sys.stdout.write("\n")
     return (True, val)
 print_.arity = 1
@@ -156,7 +209,7 @@ print_.arity = 1
 
 def emit(self, args):
     val = args[0]
-    sys.stdout.write(str(val))
+    val.write(sys.stdout)
     return (True, val)
 emit.arity = 1
 
@@ -178,7 +231,7 @@ gensym.arity = 1
 
 
 def hexbyte(self, args):
-    return (True, Atom(chr(int(args[0].text + args[1].text, 16))))
+    return (True, atom(chr(int(args[0].text + args[1].text, 16))))
 hexbyte.arity = 2
 
 
@@ -188,5 +241,32 @@ format_octal.arity = 1
 
 
 def length(self, args):
-    return (True, Atom(str(len(str(args[0])))))
+    return (True, Atom(str(args[0].flat_length())))
 length.arity = 1
+
+
+def list_append(self, args):
+    (elements, tail) = list_elements(args[0])
+    if not tail.equals(NIL):
+        return (False, Atom("malformed list %s" % args[0].repr()))
+    return (True, make_list(elements, args[1]))
+list_append.arity = 2
+
+
+def list_member(self, args):
+    x = args[0]
+    (elements, tail) = list_elements(args[1])
+    for e in elements:
+        if x.equals(e):
+            return (True, e)
+    return (False, LazyAtom(_not_a_member, x))
+list_member.arity = 2
+
+
+def _not_a_member(x):
+    return "term '%s' is not a member" % x
+
+
+def list_length(self, args):
+    return (True, Atom(str(count_elements(args[0]))))
+list_length.arity = 1
@@ -9,30 +9,45 @@
 # __repr__ : make a string that is valid Python code for constructing the Term
 
 
+from itertools import islice
+import re
+
+
 BAREWORD = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
 PRINTABLE = (' !"#$%&()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[]^_'
              '`abcdefghijklmnopqrstuvwxyz{|}~')
 
+BAREWORD_RE = re.compile(r'[0-9A-Za-z_]+\Z')
+
+# how each byte is written inside a quoted repr
+ESCAPES = tuple(
+    r"\'" if c == "'" else
+    r"\\" if c == "\\" else
+    c if c in PRINTABLE else
+    r"\x%02x" % ord(c)
+    for c in [chr(i) for i in xrange(256)]
+)
+
+# number of pieces of text the writers collect before writing them out
+WRITE_CHUNK = 1024
+
 
 def repr_escape(t):
     if len(t) == 0:
         return "''"
-    if all(c in BAREWORD for c in t):
+    if BAREWORD_RE.match(t):
         return t
-    s = ''
-    for c in t:
-        if c == "'":
-            s += r"\'"
-        elif c == "\\":
-            s += r"\\"
-        elif ord(c) > 31 and ord(c) < 127:
-            s += c
-        else:
-            s += r"\x%02x" % ord(c)
-    return "'%s'" % s
+    return "'%s'" % ''.join([ESCAPES[ord(c)] for c in t])
 
 
 class Term(object):
+    # terms are never modified once made, and there can be a great many of
+    # them, so none of them has a __dict__
+    __slots__ = ()
+
+    # True if this term contains no variables
+    ground = True
+
     def expand(self, context):
         """Expands this term, returning a new term where, for all x, all
         occurrences of (VAR x) are replaced with the value of x in the
@@ -50,27 +65,90 @@ class Term(object):
     def repr(self):
         raise NotImplementedError
 
+    def flat_length(self):
+        """Returns the length of the flattened text of this term."""
+        return len(str(self))
+
+    def write(self, out):
+        """Writes the flattened text of this term to the file-like object
+        `out`.
+
+        """
+        out.write(str(self))
+
+    def write_repr(self, out):
+        """Writes the reprified text of this term to the file-like object
+        `out`.
+
+        """
+        out.write(self.repr())
+
+    def structural_hash(self):
+        """Returns a hash of this ground term, which is equal for any two
+        terms which are equal (though two terms with equal hashes may not
+        themselves be equal.)
+
+        """
+        raise NotImplementedError
+
     @classmethod
-    def match_all(_class, patterns, values):
-        """Returns a dict of bindings if all values match all patterns,
-        or False if there was a mismatch.
+    def compile_match_all(_class, patterns):
+        """Returns a function which, given a list of values and a list of
+        slots, returns True if each value matches the corresponding
+        pattern, having put the value bound to each variable in the
+        patterns into the slots, at that variable's slot; or False if
+        some value does not match.
 
         """
-        i = 0
-        bindings = {}
-        while i < len(patterns):
-            sub = patterns[i].match(values[i])
-            if sub == False:
-                return False
-            bindings.update(sub)
-            i += 1
-        return bindings
+        matchers = [p.matcher() for p in patterns]
+        n = len(matchers)
+
+        def match_all(values, slots):
+            i = 0
+            while i < n:
+                if not matchers[i](values[i], slots):
+                    return False
+                i += 1
+            return True
+        return match_all
+
+    def match(self, value, slots):
+        """Returns True if the given value matches this term (as a
+        pattern), having put the value bound to each variable in this
+        term into the list `slots`, at that variable's slot; or False if
+        it does not match.
+
+        """
+        raise NotImplementedError
+
+    def matcher(self):
+        """Returns a function which, given a value and a list of slots,
+        does the same thing as match, but without having to work out
+        again, each time, how to match this term.
 
-    def match(self, value):
+        """
+        raise NotImplementedError
+
+    def equals(self, value):
+        """Returns True if the given value is equal to this ground term."""
+        return self.match(value, None)
+
+    def slots(self):
+        """Returns a list of the slots of the variables in this term."""
+        return []
+
+    def index_key(self):
+        """Returns a value which is equal for any two ground terms which
+        could match the same pattern, or None if this is a pattern which
+        could match any term.
+
+        """
         raise NotImplementedError
-        
+
 
 class Atom(Term):
+    __slots__ = ('text',)
+
     def __init__(self, text):
         assert not isinstance(text, unicode)
         self.text = text
@@ -84,92 +162,578 @@ class Atom(Term):
     def repr(self):
         return repr_escape(self.text)
 
-    def match(self, value):
-        if not isinstance(value, Atom):
-            return False
-        if self.text == value.text:
-            return {}
-        else:
-            return False
+    def structural_hash(self):
+        return hash(self.text)
+
+    def match(self, value, slots):
+        return value is self or (
+            isinstance(value, Atom) and self.text == value.text
+        )
+
+    def matcher(self):
+        text = self.text
+
+        def match_atom(value, slots):
+            return isinstance(value, Atom) and value.text == text
+        return match_atom
+
+    def index_key(self):
+        return self.text
 
     def reversed(self, sentinel):
-        if self.match(sentinel) != False:
+        if self.equals(sentinel):
             return self
         raise ValueError("malformed list")
 
 
+class LazyAtom(Atom):
+    """An Atom whose text is not worked out until it is needed.  Given a
+    function and some arguments, the text is the result of calling the
+    function on those arguments.  This is used for failure messages,
+    which are usually thrown away without ever being looked at.
+
+    """
+    __slots__ = ('format', 'args', '_text')
+
+    def __init__(self, format, *args):
+        self.format = format
+        self.args = args
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self.format(*self.args)
+            assert not isinstance(self._text, unicode)
+            self.format = None
+            self.args = None
+        return self._text
+
+
+class RopeAtom(Atom):
+    """An Atom made by concatenating texts onto the end of another Atom.
+    The pieces of text are kept in a list, and only joined together when
+    the text is needed.
+
+    A RopeAtom made by appending a piece to another RopeAtom shares its
+    list of pieces, and (unless something was already appended to that
+    RopeAtom) simply adds the piece to the end of the list, so that
+    building up an atom a piece at a time, as `T ← T + S` in a loop does,
+    takes time linear, not quadratic, in the length of the result.
+
+    """
+    __slots__ = ('pieces', 'count', 'size', '_text')
+
+    # concatenations shorter than this just make an ordinary Atom
+    MIN_SIZE = 128
+
+    def __init__(self, pieces, count, size):
+        """The text of the RopeAtom is the first `count` strings in the
+        list `pieces`, joined together; `size` is its length.
+
+        """
+        self.pieces = pieces
+        self.count = count
+        self.size = size
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = ''.join(self.pieces[:self.count])
+        return self._text
+
+    def flat_length(self):
+        return self.size
+
+    def write(self, out):
+        if self._text is not None:
+            out.write(self._text)
+        else:
+            write_pieces(islice(self.pieces, self.count), out)
+
+    def append(self, text):
+        """Returns a RopeAtom whose text is this one's followed by the
+        given text.
+
+        """
+        pieces = self.pieces
+        size = self.size + len(text)
+        if len(pieces) == self.count:
+            pieces.append(text)
+            return RopeAtom(pieces, self.count + 1, size)
+        # something else was appended to this one already (for example,
+        # before backtracking), so this one can't share the list after all
+        return RopeAtom([self.text, text], 2, size)
+
+
 class Constructor(Term):
+    __slots__ = ('tag', 'contents', 'ground', '_hash')
+
     def __init__(self, tag, contents):
         assert not isinstance(tag, unicode)
         self.tag = tag
         for c in contents:
             assert isinstance(c, Term), repr(c)
         self.contents = contents
+        self.ground = all(c.ground for c in contents)
+        # the structural hash of this term, once it has been worked out.
+        # (the flattened and reprified texts are not kept, as every
+        # subterm of a term would then keep its own copy of its part of
+        # the text.)
+        self._hash = None
 
     def expand(self, context):
-        return Constructor(self.tag, [x.expand(context) for x in self.contents])
+        # terms are never modified, so a term with nothing to expand can
+        # stand for its own expansion
+        if self.ground:
+            return self
+        return constructor(self.tag, [x.expand(context) for x in self.contents])
 
     def __str__(self):
-        return "%s(%s)" % (
-            self.tag, ', '.join([str(x) for x in self.contents])
-        )
+        return ''.join(text_pieces(self))
 
     def __repr__(self):
         return "Constructor(%r, %r)" % (self.tag, self.contents)
 
     def repr(self):
-        return "%s(%s)" % (
-            repr_escape(self.tag), ', '.join([x.repr() for x in self.contents])
-        )
-
-    def match(self, value):
+        return ''.join(text_pieces(self, reprify=True))
+
+    def write(self, out):
+        write_pieces(text_pieces(self), out)
+
+    def write_repr(self, out):
+        write_pieces(text_pieces(self, reprify=True), out)
+
+    def structural_hash(self):
+        if self._hash is None:
+            # work out the hashes of the subterms, deepest first, so that
+            # working out the hash of a long list does not recurse (a
+            # ListTerm works out its own hash without recursing)
+            pending = [self]
+            unhashed = []
+            while pending:
+                t = pending.pop()
+                if t.__class__ is Constructor and t._hash is None:
+                    unhashed.append(t)
+                    pending.extend(t.contents)
+            for t in reversed(unhashed):
+                t._hash = hash(
+                    (t.tag, tuple([x.structural_hash() for x in t.contents]))
+                )
+        return self._hash
+
+    def match(self, value, slots):
+        if value is self:
+            return True
         if not isinstance(value, Constructor):
             return False
         if self.tag != value.tag:
             return False
         if len(self.contents) != len(value.contents):
             return False
-        bindings = {}
+        # if this is a ground term, it can only match an equal term, and
+        # terms with different hashes can't be equal
+        if (self.ground and
+            self.structural_hash() != value.structural_hash()):
+            return False
+        contents = self.contents
+        values = value.contents
         i = 0
-        while i < len(self.contents):
-            b = self.contents[i].match(value.contents[i])
-            if b == False:
+        while i < len(contents):
+            if not contents[i].match(values[i], slots):
                 return False
-            bindings.update(b)
             i += 1
-        return bindings
+        return True
+
+    def equals(self, value):
+        if value is self:
+            return True
+        if (not isinstance(value, Constructor) or
+            self.structural_hash() != value.structural_hash()):
+            return False
+        # compare the terms a pair of subterms at a time, instead of
+        # recursing, so that long lists can be compared
+        pending = [(self, value)]
+        while pending:
+            (t, v) = pending.pop()
+            if t is v:
+                continue
+            if not isinstance(t, Constructor):
+                if not t.equals(v):
+                    return False
+                continue
+            if (not isinstance(v, Constructor) or t.tag != v.tag or
+                len(t.contents) != len(v.contents)):
+                return False
+            pending.extend(zip(t.contents, v.contents))
+        return True
+
+    def matcher(self):
+        if self.ground:
+            term = self
+
+            def match_ground(value, slots):
+                return term.equals(value)
+            return match_ground
+        tag = self.tag
+        matchers = [c.matcher() for c in self.contents]
+        n = len(matchers)
+
+        def match_constructor(value, slots):
+            if not isinstance(value, Constructor):
+                return False
+            if value.tag != tag or len(value.contents) != n:
+                return False
+            contents = value.contents
+            i = 0
+            while i < n:
+                if not matchers[i](contents[i], slots):
+                    return False
+                i += 1
+            return True
+        return match_constructor
+
+    def slots(self):
+        slots = []
+        for c in self.contents:
+            slots.extend(c.slots())
+        return slots
+
+    def index_key(self):
+        return (self.tag, len(self.contents))
 
     def reversed(self, sentinel):
         acc = sentinel
         l = self
         tag = self.tag
         while isinstance(l, Constructor) and l.tag == tag:
-            acc = Constructor(tag, [l.contents[0], acc])
+            acc = constructor(tag, [l.contents[0], acc])
             if len(l.contents) < 2:
                 break
             l = l.contents[1]
-        if l.match(sentinel) == False:
+        if not l.equals(sentinel):
             raise ValueError("malformed list %s" % l.repr())
         return acc
 
 
+class ListTerm(Constructor):
+    """A ground `list(H, T)` term, which keeps its elements in a Python
+    list instead of in a chain of Constructors.  It matches, flattens,
+    and reprifies exactly as the equivalent chain of Constructors would.
+
+    The elements are kept in reverse order, so that, as with RopeAtom, a
+    ListTerm made by putting an element on the front of another ListTerm
+    shares its list of elements, and (unless something was already put
+    on the front of that ListTerm) simply adds the element to the end of
+    the list.
+
+    ListTerms which share a list of elements also share a list of their
+    structural hashes, so that the hash of a ListTerm made by putting an
+    element on the front of another is worked out from the other's.
+
+    """
+    __slots__ = ('items', 'count', 'tail', 'hashes', '_rest')
+
+    tag = 'list'
+
+    def __init__(self, items, count, tail, hashes=None):
+        """The elements of the ListTerm are the first `count` terms in the
+        list `items`, in reverse order; `tail` is what follows the last of
+        them (usually `nil`, but possibly another ListTerm.)  `hashes`,
+        if given, is the list of hashes shared by the other ListTerms on
+        `items`; its i'th entry, once worked out, is the structural hash
+        of the one whose count is i + 1.
+
+        """
+        self.items = items
+        self.count = count
+        self.tail = tail
+        if hashes is None:
+            hashes = []
+        self.hashes = hashes
+        # the ListTerm for all but the first element, once it is needed
+        self._rest = None
+        self.ground = True
+
+    @property
+    def contents(self):
+        count = self.count
+        if count == 1:
+            return [self.items[0], self.tail]
+        if self._rest is None:
+            self._rest = ListTerm(self.items, count - 1, self.tail,
+                                  self.hashes)
+        return [self.items[count - 1], self._rest]
+
+    def __repr__(self):
+        # as the equivalent chain of Constructors would be written, but
+        # without recursing down it
+        items = self.items
+        heads = ["Constructor(%r, [%r, " % (self.tag, items[i])
+                 for i in xrange(self.count - 1, -1, -1)]
+        return ''.join(heads) + repr(self.tail) + '])' * self.count
+
+    def structural_hash(self):
+        hashes = self.hashes
+        i = len(hashes)
+        if i < self.count:
+            if i == 0:
+                h = self.tail.structural_hash()
+            else:
+                h = hashes[i - 1]
+            items = self.items
+            while i < self.count:
+                h = hash(('list', (items[i].structural_hash(), h)))
+                hashes.append(h)
+                i += 1
+        return hashes[self.count - 1]
+
+    def prepend(self, head):
+        """Returns a ListTerm whose first element is `head` and whose
+        remaining elements are this one's.
+
+        """
+        items = self.items
+        if len(items) == self.count:
+            items.append(head)
+            return ListTerm(items, self.count + 1, self.tail, self.hashes)
+        # something else was put on the front of this one already, so
+        # this one can't share the list after all
+        return ListTerm([head], 1, self)
+
+    def reversed(self, sentinel):
+        if isinstance(self.tail, Constructor) and self.tail.tag == 'list':
+            return Constructor.reversed(self, sentinel)
+        if not self.tail.equals(sentinel):
+            raise ValueError("malformed list %s" % self.tail.repr())
+        return make_list(self.items[:self.count], sentinel)
+
+
 class Variable(Term):
-    def __init__(self, name):
+    __slots__ = ('name', 'slot')
+
+    ground = False
+
+    def __init__(self, name, slot=None):
+        """`slot` is the index, in the frame of the production branch
+        this Variable occurs in, where its value is kept.  It is assigned
+        by the Analyzer.
+
+        """
         assert not isinstance(name, unicode)
         assert name[0].isupper() or name[0] == u'_', name
         self.name = name
+        self.slot = slot
 
     def expand(self, context):
-        return context.fetch(self.name)
+        return context.fetch(self.slot)
 
     def __str__(self):
         return self.name
 
     def __repr__(self):
-        return "Variable(%r)" % (self.name)
+        return "Variable(%r, %r)" % (self.name, self.slot)
 
     def repr(self):
         return self.name
 
-    def match(self, value):
-        return {self.name: value}
+    def match(self, value, slots):
+        slots[self.slot] = value
+        return True
+
+    def matcher(self):
+        slot = self.slot
+
+        def match_variable(value, slots):
+            slots[slot] = value
+            return True
+        return match_variable
+
+    def slots(self):
+        return [self.slot]
+
+    def index_key(self):
+        return None
+
+
+class TermKey(object):
+    """Wraps a ground term so that it can be (part of) a dict key.  Two
+    TermKeys are equal if their terms are equal, and are hashed by the
+    structural hash of their terms, so the text of the term is never
+    built up just to look it up.
+
+    """
+    __slots__ = ('term', 'hash')
+
+    def __init__(self, term):
+        self.term = term
+        self.hash = term.structural_hash()
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return self.hash == other.hash and self.term.equals(other.term)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+def text_pieces(term, reprify=False):
+    """Generates, without recursing, the pieces of text which make up the
+    flattened text of the given term (or its reprified text, if `reprify`
+    is true.)
+
+    """
+    stack = [term]
+    while stack:
+        t = stack.pop()
+        if isinstance(t, str):
+            yield t
+        elif not isinstance(t, Constructor):
+            yield t.repr() if reprify else str(t)
+        elif isinstance(t, ListTerm):
+            # list(E1, list(E2, ... list(En, T)...)), without making a
+            # ListTerm for each of the sublists
+            items = t.items
+            stack.append(')' * t.count)
+            stack.append(t.tail)
+            i = 0
+            while i < t.count:
+                stack.append(', ')
+                stack.append(items[i])
+                stack.append('list(')
+                i += 1
+        else:
+            yield repr_escape(t.tag) if reprify else t.tag
+            yield '('
+            stack.append(')')
+            contents = t.contents
+            i = len(contents) - 1
+            while i >= 0:
+                stack.append(contents[i])
+                if i > 0:
+                    stack.append(', ')
+                i -= 1
+
+
+def write_pieces(pieces, out):
+    """Writes the given pieces of text to the file-like object `out`, a
+    chunk at a time.
+
+    """
+    chunk = []
+    for piece in pieces:
+        chunk.append(piece)
+        if len(chunk) >= WRITE_CHUNK:
+            out.write(''.join(chunk))
+            chunk = []
+    out.write(''.join(chunk))
+
+
+# the Atom for each single byte; these are shared, since each character
+# scanned from the input would otherwise be a new one
+BYTE_ATOMS = tuple(Atom(chr(i)) for i in xrange(256))
+
+# Atoms which have been interned, by their text
+INTERNED_ATOMS = {}
+
+
+def atom(text):
+    """Returns an Atom with the given text.  If the text is a single byte,
+    it is the shared Atom for that byte.
+
+    """
+    if len(text) == 1:
+        return BYTE_ATOMS[ord(text)]
+    return Atom(text)
+
+
+def intern_atom(text):
+    """Returns the one shared Atom with the given text.  Because interned
+    Atoms are kept forever, this is meant for texts of which there are a
+    limited number, such as the literal atoms in a program.
+
+    """
+    a = INTERNED_ATOMS.get(text)
+    if a is None:
+        a = atom(text)
+        INTERNED_ATOMS[text] = a
+    return a
+
+
+def constructor(tag, contents):
+    """Returns a Constructor with the given tag and contents.  If it is a
+    ground `list(H, T)`, it is a ListTerm.
+
+    """
+    if tag == 'list' and len(contents) == 2:
+        (head, tail) = contents
+        if head.ground and tail.ground:
+            if isinstance(tail, ListTerm):
+                return tail.prepend(head)
+            return ListTerm([head], 1, tail)
+    return Constructor(tag, contents)
+
+
+def make_list(elements, tail):
+    """Returns the ground list term `list(E1, list(E2, ... tail))`, where
+    `elements` is the Python list [E1, E2, ...].
+
+    """
+    if not elements:
+        return tail
+    return ListTerm(elements[::-1], len(elements), tail)
+
+
+def list_elements(term):
+    """Returns a Python list of the elements of the given list term, and
+    the term which follows the last of them (the first term along the
+    list which is not a `list(H, T)`.)
+
+    """
+    elements = []
+    while isinstance(term, Constructor) and term.tag == 'list':
+        if isinstance(term, ListTerm):
+            elements.extend(term.items[term.count - 1::-1])
+            term = term.tail
+        elif len(term.contents) == 2:
+            elements.append(term.contents[0])
+            term = term.contents[1]
+        else:
+            break
+    return (elements, term)
+
+
+def count_elements(term):
+    """Returns the number of elements in the given list term."""
+    n = 0
+    while isinstance(term, Constructor) and term.tag == 'list':
+        if isinstance(term, ListTerm):
+            n += term.count
+            term = term.tail
+        elif len(term.contents) == 2:
+            n += 1
+            term = term.contents[1]
+        else:
+            break
+    return n
+
+
+def concat(lhs, rhs):
+    """Returns an Atom whose text is the flattened text of `lhs` followed
+    by the flattened text of `rhs`.
+
+    """
+    right = str(rhs)
+    if isinstance(lhs, RopeAtom):
+        return lhs.append(right)
+    left = str(lhs)
+    size = len(left) + len(right)
+    if size < RopeAtom.MIN_SIZE:
+        return atom(left + right)
+    return RopeAtom([left, right], 2, size)
+
+
+NIL = intern_atom('nil')
@@ -47,6 +47,11 @@ fi
 if [ x$1 = xthorough ]; then
    echo "Testing EVERYTHING.  This will take more than 8 minutes.  (On a FAST machine.)"
    $0 interpreter &&
+   $0 packrat &&
+   $0 closure &&
+   $0 stack &&
+   $0 error-reporting &&
+   $0 command-line &&
    $0 compiler &&
    $0 interpreted scanner &&
    $0 interpreted grammar &&
@@ -115,9 +120,21 @@ test_it() {
 if [ x$1 = xinterpreter -o x$1 = xi ]; then
     echo "*** Testing Python interpreter..."
     falderal $VERBOSE --substring-error fixture/tamsin.py.markdown $FILES
+elif [ x$1 = xpackrat ]; then
+    echo "*** Testing Python interpreter in packrat mode..."
+    falderal $VERBOSE --substring-error fixture/tamsin.py-packrat.markdown $FILES
+elif [ x$1 = xclosure ]; then
+    echo "*** Testing Python interpreter with closure engine..."
+    falderal $VERBOSE --substring-error fixture/tamsin.py-closure.markdown $FILES
+elif [ x$1 = xstack ]; then
+    echo "*** Testing Python interpreter with stack engine..."
+    falderal $VERBOSE --substring-error fixture/tamsin.py-stack.markdown $FILES doc/Stack_Engine.markdown
 elif [ x$1 = xerror-reporting ]; then
     echo "*** Testing error reporting in Python interpreter..."
     falderal $VERBOSE --substring-error fixture/tamsin.py.markdown doc/Error_Reporting.markdown
+elif [ x$1 = xcommand-line ]; then
+    echo "*** Testing command-line options of Python interpreter..."
+    falderal $VERBOSE --substring-error fixture/tamsin.py.markdown doc/Command_Line.markdown
 elif [ x$1 = xcompiler ]; then
     make c_src/libtamsin.a || exit 1
     echo "*** Testing compiler..."
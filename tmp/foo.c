@@ -0,0 +1,413 @@
+
+  /*
+   * Generated code!  Edit at your own risk!
+   * Must be linked with -ltamsin to build.
+   */
+  #include <assert.h>
+  #include <tamsin.h>
+  
+  /* global scanner */
+  
+  struct scanner * scanner;
+  
+  /* global state: result of last action */
+  
+  int ok;
+  const struct term *result;
+  void prod_main_main();
+void prod_main_escaped();
+void prod_main_escaped_r();
+void prod_main_many_format_octal();
+void prod_main_main() {
+{
+const struct term *unifier[] = {};
+if (
+    1) {
+const struct term *temp1 = term_new_atom("\"\342\231\245\n\302\253\"", 8);
+prod_main_escaped(temp1);
+return;}
+}
+result = term_new_atom_from_cstring("No 'main' production matched arguments");
+ok = 0;
+}
+void prod_main_escaped(const struct term *formal2) {
+{
+const struct term *pattern3 = term_new_variable("S", 1, 0);
+const struct term *unifier[] = {NULL};
+if (
+    term_match_unifier(pattern3, formal2, unifier) &&
+    1) {
+const struct term *S = unifier[0];
+assert(S != NULL);
+{
+const struct term *temp4 = S;
+const struct term *flat5 = term_flatten(temp4);
+const struct term *save_S;
+int position;
+int reset_position;
+const char *buffer;
+int buffer_size;
+save_S = S;
+position = scanner->position;
+reset_position = scanner->reset_position;
+buffer = scanner->buffer;
+buffer_size = scanner->size;
+scanner->buffer = flat5->atom;
+scanner->size = flat5->size;
+scanner->position = 0;
+scanner->reset_position = 0;
+prod_main_escaped_r();
+scanner->position = position;
+scanner->reset_position = reset_position;
+scanner->buffer = buffer;
+scanner->size = buffer_size;
+S = save_S;
+}
+return;}
+}
+result = term_new_atom_from_cstring("No 'escaped' production matched arguments");
+ok = 0;
+}
+void prod_main_escaped_r() {
+{
+const struct term *unifier[] = {};
+if (
+    1) {
+const struct term *A;
+const struct term *B;
+const struct term *temp6 = term_new_atom("", 0);
+result = temp6;
+A = result;
+ok = 1;
+if (ok) {
+{
+const struct term *save_A;
+const struct term *save_B;
+int position;
+int reset_position;
+const char *buffer;
+int buffer_size;
+const struct term *temp7 = term_new_atom("nil", 3);
+ok = 1;
+while (ok) {
+save_A = A;
+save_B = B;
+position = scanner->position;
+reset_position = scanner->reset_position;
+buffer = scanner->buffer;
+buffer_size = scanner->size;
+{
+const struct term *save_A;
+const struct term *save_B;
+int position;
+int reset_position;
+const char *buffer;
+int buffer_size;
+save_A = A;
+save_B = B;
+position = scanner->position;
+reset_position = scanner->reset_position;
+buffer = scanner->buffer;
+buffer_size = scanner->size;
+{
+const struct term *save_A;
+const struct term *save_B;
+int position;
+int reset_position;
+const char *buffer;
+int buffer_size;
+save_A = A;
+save_B = B;
+position = scanner->position;
+reset_position = scanner->reset_position;
+buffer = scanner->buffer;
+buffer_size = scanner->size;
+{
+const struct term *save_A;
+const struct term *save_B;
+int position;
+int reset_position;
+const char *buffer;
+int buffer_size;
+save_A = A;
+save_B = B;
+position = scanner->position;
+reset_position = scanner->reset_position;
+buffer = scanner->buffer;
+buffer_size = scanner->size;
+{
+const struct term *save_A;
+const struct term *save_B;
+int position;
+int reset_position;
+const char *buffer;
+int buffer_size;
+save_A = A;
+save_B = B;
+position = scanner->position;
+reset_position = scanner->reset_position;
+buffer = scanner->buffer;
+buffer_size = scanner->size;
+const struct term *temp8 = term_new_atom("\\", 1);
+tamsin_expect(scanner, temp8);
+if (ok) {
+const struct term *temp9 = A;
+const struct term *temp10 = term_new_atom("\\\\", 2);
+const struct term *temp11 = term_concat(term_flatten(temp9), term_flatten(temp10));
+result = temp11;
+A = result;
+ok = 1;
+}
+if (!ok) {
+scanner->position = position;
+scanner->reset_position = reset_position;
+scanner->buffer = buffer;
+scanner->size = buffer_size;
+A = save_A;
+B = save_B;
+const struct term *temp12 = term_new_atom("\"", 1);
+tamsin_expect(scanner, temp12);
+if (ok) {
+const struct term *temp13 = A;
+const struct term *temp14 = term_new_atom("\\\"", 2);
+const struct term *temp15 = term_concat(term_flatten(temp13), term_flatten(temp14));
+result = temp15;
+A = result;
+ok = 1;
+}
+}
+}
+if (!ok) {
+scanner->position = position;
+scanner->reset_position = reset_position;
+scanner->buffer = buffer;
+scanner->size = buffer_size;
+A = save_A;
+B = save_B;
+const struct term *temp16 = term_new_atom("\n", 1);
+tamsin_expect(scanner, temp16);
+if (ok) {
+const struct term *temp17 = A;
+const struct term *temp18 = term_new_atom("\\n", 2);
+const struct term *temp19 = term_concat(term_flatten(temp17), term_flatten(temp18));
+result = temp19;
+A = result;
+ok = 1;
+}
+}
+}
+if (!ok) {
+scanner->position = position;
+scanner->reset_position = reset_position;
+scanner->buffer = buffer;
+scanner->size = buffer_size;
+A = save_A;
+B = save_B;
+tamsin_alnum(scanner);
+B = result;
+if (ok) {
+const struct term *temp20 = A;
+const struct term *temp21 = B;
+const struct term *temp22 = term_concat(term_flatten(temp20), term_flatten(temp21));
+result = temp22;
+A = result;
+ok = 1;
+}
+}
+}
+if (!ok) {
+scanner->position = position;
+scanner->reset_position = reset_position;
+scanner->buffer = buffer;
+scanner->size = buffer_size;
+A = save_A;
+B = save_B;
+tamsin_any(scanner);
+B = result;
+if (ok) {
+{
+const struct term *temp23 = B;
+const struct term *flat24 = term_flatten(temp23);
+const struct term *save_A;
+const struct term *save_B;
+int position;
+int reset_position;
+const char *buffer;
+int buffer_size;
+save_A = A;
+save_B = B;
+position = scanner->position;
+reset_position = scanner->reset_position;
+buffer = scanner->buffer;
+buffer_size = scanner->size;
+scanner->buffer = flat24->atom;
+scanner->size = flat24->size;
+scanner->position = 0;
+scanner->reset_position = 0;
+prod_main_many_format_octal();
+scanner->position = position;
+scanner->reset_position = reset_position;
+scanner->buffer = buffer;
+scanner->size = buffer_size;
+A = save_A;
+B = save_B;
+}
+B = result;
+}
+if (ok) {
+const struct term *temp25 = A;
+const struct term *temp26 = B;
+const struct term *temp27 = term_concat(term_flatten(temp25), term_flatten(temp26));
+result = temp27;
+A = result;
+ok = 1;
+}
+}
+}
+if (ok) {
+temp7 = result;
+}
+}
+scanner->position = position;
+scanner->reset_position = reset_position;
+scanner->buffer = buffer;
+scanner->size = buffer_size;
+A = save_A;
+B = save_B;
+result = temp7;
+ok = 1;
+}
+}
+if (ok) {
+const struct term *temp28 = A;
+result = temp28;
+ok = 1;
+}
+return;}
+}
+result = term_new_atom_from_cstring("No 'escaped_r' production matched arguments");
+ok = 0;
+}
+void prod_main_many_format_octal() {
+{
+const struct term *unifier[] = {};
+if (
+    1) {
+const struct term *S;
+const struct term *B;
+const struct term *temp29 = term_new_atom("", 0);
+result = temp29;
+S = result;
+ok = 1;
+if (ok) {
+scanner_push_engine(scanner, &scanner_byte_engine);
+{
+const struct term *save_S;
+const struct term *save_B;
+int position;
+int reset_position;
+const char *buffer;
+int buffer_size;
+const struct term *temp30 = term_new_atom("nil", 3);
+ok = 1;
+while (ok) {
+save_S = S;
+save_B = B;
+position = scanner->position;
+reset_position = scanner->reset_position;
+buffer = scanner->buffer;
+buffer_size = scanner->size;
+tamsin_any(scanner);
+B = result;
+if (ok) {
+const struct term *temp31 = B;
+result = tamsin_format_octal(temp31);
+ok = 1;
+B = result;
+}
+if (ok) {
+const struct term *temp32 = S;
+const struct term *temp33 = term_new_atom("\\", 1);
+const struct term *temp34 = term_concat(term_flatten(temp32), term_flatten(temp33));
+const struct term *temp35 = B;
+const struct term *temp36 = term_concat(term_flatten(temp34), term_flatten(temp35));
+result = temp36;
+S = result;
+ok = 1;
+}
+if (ok) {
+temp30 = result;
+}
+}
+scanner->position = position;
+scanner->reset_position = reset_position;
+scanner->buffer = buffer;
+scanner->size = buffer_size;
+S = save_S;
+B = save_B;
+result = temp30;
+ok = 1;
+}
+scanner_pop_engine(scanner);
+}
+if (ok) {
+const struct term *temp37 = S;
+result = temp37;
+ok = 1;
+}
+return;}
+}
+result = term_new_atom_from_cstring("No 'many_format_octal' production matched arguments");
+ok = 0;
+}
+
+  const struct term *bufterm = NULL;
+  
+  int read_file(FILE *input) {
+      char *buffer = malloc(8193);
+  
+      assert(input != NULL);
+  
+      while (!feof(input)) {
+          int num_read = fread(buffer, 1, 8192, input);
+          if (bufterm == NULL) {
+              bufterm = term_new_atom(buffer, num_read);
+          } else {
+              bufterm = term_concat(bufterm, term_new_atom(buffer, num_read));
+          }
+      }
+  
+      free(buffer);
+  }
+  
+  int main(int argc, char **argv) {
+  
+      if (argc == 1) {
+          read_file(stdin);
+      } else {
+          int i;
+  
+          for (i = 1; i < argc; i++) {
+              FILE *input = fopen(argv[i], "r");
+              read_file(input);
+              fclose(input);
+          }
+      }
+  
+      scanner = scanner_new(bufterm->atom, bufterm->size);
+      ok = 0;
+      result = term_new_atom_from_cstring("nil");
+  
+      prod_main_main();
+  
+      if (ok) {
+          term_fput(result, stdout);
+          fwrite("\n", 1, 1, stdout);
+          exit(0);
+      } else {
+          term_fput(result, stderr);
+          fwrite("\n", 1, 1, stderr);
+          exit(1);
+      }
+  }
+  